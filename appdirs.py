@@ -19,6 +19,11 @@ __version_info__ = tuple(int(segment) for segment in __version__.split("."))
 
 import sys
 import os
+import errno
+import itertools
+import stat
+import time
+from collections import namedtuple
 
 PY3 = sys.version_info[0] == 3
 
@@ -40,9 +45,104 @@ if sys.platform.startswith('java'):
 else:
     system = sys.platform
 
+_scandir = getattr(os, "scandir", None)
 
+try:
+    from _thread import allocate_lock as _allocate_lock
+except ImportError:
+    from thread import allocate_lock as _allocate_lock
 
-def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
+_shared_lock = _allocate_lock()  # guards `AppDirs.shared()`
+
+# Environment reads by the public functions go through this name so that
+# `enable_instrumentation()` can count them.
+_getenv = os.getenv
+
+# Environment variables consulted when resolving dirs. `AppDirs` caches
+# resolved paths keyed on these (and on `system`).
+_ENV_VARS = (
+    "HOME",
+    "USERPROFILE",
+    "XDG_DATA_HOME",
+    "XDG_CONFIG_HOME",
+    "XDG_CACHE_HOME",
+    "XDG_STATE_HOME",
+    "XDG_DATA_DIRS",
+    "XDG_CONFIG_DIRS",
+    "XDG_RUNTIME_DIR",
+    "TMPDIR",
+)
+
+
+# Every kind of dir, in the order used by `AppDirsLayout`.
+_KINDS = (
+    "user_data_dir",
+    "user_config_dir",
+    "user_cache_dir",
+    "user_state_dir",
+    "user_log_dir",
+    "site_data_dir",
+    "site_config_dir",
+    "user_runtime_dir",
+)
+
+_USER_KINDS = tuple(kind for kind in _KINDS if kind.startswith("user_"))
+
+AppDirsLayout = namedtuple("AppDirsLayout", _KINDS)
+
+DiskUsage = namedtuple("DiskUsage", ("bytes", "files"))
+
+
+class LockTimeout(IOError):
+    """Raised when a `FileLock` could not be acquired in time."""
+
+
+def _probe_raw_environ():
+    """Return (environ, data, keys) for reading `os.environ` fast, or None.
+
+    CPython 3 keeps the environment in the private dict `os.environ._data`,
+    keyed by encoded names; reading it directly is about ten times faster
+    than `os.environ.get`, which matters for `AppDirs` cache checks. It is
+    only used if it is there and agrees with `os.environ` for `_ENV_VARS`.
+    """
+    environ = os.environ
+    try:
+        data = environ._data
+        keys = tuple(environ.encodekey(name) for name in _ENV_VARS)
+        decode = environ.decodevalue
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if type(data) is not dict:
+        return None
+    for name, key in zip(_ENV_VARS, keys):
+        value = data.get(key)
+        if value is not None:
+            value = decode(value)
+        if value != environ.get(name):
+            return None
+    return environ, data, keys
+
+_raw_environ = _probe_raw_environ()
+
+
+def _env_fingerprint():
+    """Return a hashable snapshot of everything dir resolution depends on.
+
+    Values are raw (encoded) where `_raw_environ` is used, so compare
+    fingerprints only with other fingerprints.
+    """
+    raw = _raw_environ
+    if raw is not None and os.environ is raw[0]:
+        get = raw[1].get
+        values = [get(key) for key in raw[2]]
+    else:
+        get = os.environ.get
+        values = [get(name) for name in _ENV_VARS]
+    return (system, _folder_generation) + tuple(values)
+
+
+def user_data_dir(appname=None, appauthor=None, version=None, roaming=False,
+                  env=None, home=None):
     r"""Return full path to the user-specific data dir for this application.
 
         "appname" is the name of application.
@@ -62,6 +162,11 @@ def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical user data directories are:
         Mac OS X:               ~/Library/Application Support/<AppName>
@@ -85,11 +190,12 @@ def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
             else:
                 path = os.path.join(path, appname)
     elif system == 'darwin':
-        path = os.path.expanduser('~/Library/Application Support/')
+        path = _expanduser('~/Library/Application Support/', env, home)
         if appname:
             path = os.path.join(path, appname)
     else:
-        path = os.getenv('XDG_DATA_HOME', os.path.expanduser("~/.local/share"))
+        path = _env_get(env, 'XDG_DATA_HOME',
+                        _expanduser("~/.local/share", env, home))
         if appname:
             path = os.path.join(path, appname)
     if appname and version:
@@ -97,7 +203,8 @@ def user_data_dir(appname=None, appauthor=None, version=None, roaming=False):
     return path
 
 
-def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
+def site_data_dir(appname=None, appauthor=None, version=None, multipath=False,
+                  env=None, home=None):
     r"""Return full path to the user-shared data dir for this application.
 
         "appname" is the name of application.
@@ -116,6 +223,11 @@ def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
             returned. By default, the first item from XDG_DATA_DIRS is
             returned, or '/usr/local/share/<AppName>',
             if XDG_DATA_DIRS is not set
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical site data directories are:
         Mac OS X:   /Library/Application Support/<AppName>
@@ -144,9 +256,10 @@ def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
     else:
         # XDG default for $XDG_DATA_DIRS
         # only first, if multipath is False
-        path = os.getenv('XDG_DATA_DIRS',
-                         os.pathsep.join(['/usr/local/share', '/usr/share']))
-        pathlist = [os.path.expanduser(x.rstrip(os.sep)) for x in path.split(os.pathsep)]
+        path = _env_get(env, 'XDG_DATA_DIRS',
+                        os.pathsep.join(['/usr/local/share', '/usr/share']))
+        pathlist = [_expanduser(x.rstrip(os.sep), env, home)
+                    for x in path.split(os.pathsep)]
         if appname:
             if version:
                 appname = os.path.join(appname, version)
@@ -163,7 +276,8 @@ def site_data_dir(appname=None, appauthor=None, version=None, multipath=False):
     return path
 
 
-def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
+def user_config_dir(appname=None, appauthor=None, version=None, roaming=False,
+                    env=None, home=None):
     r"""Return full path to the user-specific config dir for this application.
 
         "appname" is the name of application.
@@ -183,6 +297,11 @@ def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical user config directories are:
         Mac OS X:               same as user_data_dir
@@ -193,9 +312,10 @@ def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
     That means, by default "~/.config/<AppName>".
     """
     if system in ["win32", "darwin"]:
-        path = user_data_dir(appname, appauthor, None, roaming)
+        path = user_data_dir(appname, appauthor, None, roaming, env, home)
     else:
-        path = os.getenv('XDG_CONFIG_HOME', os.path.expanduser("~/.config"))
+        path = _env_get(env, 'XDG_CONFIG_HOME',
+                        _expanduser("~/.config", env, home))
         if appname:
             path = os.path.join(path, appname)
     if appname and version:
@@ -203,7 +323,8 @@ def user_config_dir(appname=None, appauthor=None, version=None, roaming=False):
     return path
 
 
-def site_config_dir(appname=None, appauthor=None, version=None, multipath=False):
+def site_config_dir(appname=None, appauthor=None, version=None, multipath=False,
+                    env=None, home=None):
     r"""Return full path to the user-shared data dir for this application.
 
         "appname" is the name of application.
@@ -221,6 +342,11 @@ def site_config_dir(appname=None, appauthor=None, version=None, multipath=False)
             which indicates that the entire list of config dirs should be
             returned. By default, the first item from XDG_CONFIG_DIRS is
             returned, or '/etc/xdg/<AppName>', if XDG_CONFIG_DIRS is not set
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical site config directories are:
         Mac OS X:   same as site_data_dir
@@ -240,8 +366,9 @@ def site_config_dir(appname=None, appauthor=None, version=None, multipath=False)
     else:
         # XDG default for $XDG_CONFIG_DIRS
         # only first, if multipath is False
-        path = os.getenv('XDG_CONFIG_DIRS', '/etc/xdg')
-        pathlist = [os.path.expanduser(x.rstrip(os.sep)) for x in path.split(os.pathsep)]
+        path = _env_get(env, 'XDG_CONFIG_DIRS', '/etc/xdg')
+        pathlist = [_expanduser(x.rstrip(os.sep), env, home)
+                    for x in path.split(os.pathsep)]
         if appname:
             if version:
                 appname = os.path.join(appname, version)
@@ -254,7 +381,8 @@ def site_config_dir(appname=None, appauthor=None, version=None, multipath=False)
     return path
 
 
-def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
+def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True,
+                   env=None, home=None):
     r"""Return full path to the user-specific cache dir for this application.
 
         "appname" is the name of application.
@@ -271,6 +399,11 @@ def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
         "opinion" (boolean) can be False to disable the appending of
             "Cache" to the base app data dir for Windows. See
             discussion below.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical user cache directories are:
         Mac OS X:   ~/Library/Caches/<AppName>
@@ -299,11 +432,11 @@ def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
             if opinion:
                 path = os.path.join(path, "Cache")
     elif system == 'darwin':
-        path = os.path.expanduser('~/Library/Caches')
+        path = _expanduser('~/Library/Caches', env, home)
         if appname:
             path = os.path.join(path, appname)
     else:
-        path = os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+        path = _env_get(env, 'XDG_CACHE_HOME', _expanduser('~/.cache', env, home))
         if appname:
             path = os.path.join(path, appname)
     if appname and version:
@@ -311,7 +444,8 @@ def user_cache_dir(appname=None, appauthor=None, version=None, opinion=True):
     return path
 
 
-def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
+def user_state_dir(appname=None, appauthor=None, version=None, roaming=False,
+                   env=None, home=None):
     r"""Return full path to the user-specific state dir for this application.
 
         "appname" is the name of application.
@@ -331,6 +465,11 @@ def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
             sync'd on login. See
             <http://technet.microsoft.com/en-us/library/cc766489(WS.10).aspx>
             for a discussion of issues.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical user state directories are:
         Mac OS X:  same as user_data_dir
@@ -343,9 +482,10 @@ def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
     That means, by default "~/.local/state/<AppName>".
     """
     if system in ["win32", "darwin"]:
-        path = user_data_dir(appname, appauthor, None, roaming)
+        path = user_data_dir(appname, appauthor, None, roaming, env, home)
     else:
-        path = os.getenv('XDG_STATE_HOME', os.path.expanduser("~/.local/state"))
+        path = _env_get(env, 'XDG_STATE_HOME',
+                        _expanduser("~/.local/state", env, home))
         if appname:
             path = os.path.join(path, appname)
     if appname and version:
@@ -353,7 +493,8 @@ def user_state_dir(appname=None, appauthor=None, version=None, roaming=False):
     return path
 
 
-def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
+def user_log_dir(appname=None, appauthor=None, version=None, opinion=True,
+                 env=None, home=None):
     r"""Return full path to the user-specific log dir for this application.
 
         "appname" is the name of application.
@@ -370,6 +511,11 @@ def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
         "opinion" (boolean) can be False to disable the appending of
             "Logs" to the base app data dir for Windows, and "log" to the
             base cache dir for Unix. See discussion below.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
 
     Typical user log directories are:
         Mac OS X:   ~/Library/Logs/<AppName>
@@ -386,16 +532,16 @@ def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
     This can be disabled with the `opinion=False` option.
     """
     if system == "darwin":
-        path = os.path.join(
-            os.path.expanduser('~/Library/Logs'),
-            appname)
+        path = _expanduser('~/Library/Logs', env, home)
+        if appname:
+            path = os.path.join(path, appname)
     elif system == "win32":
-        path = user_data_dir(appname, appauthor, version)
+        path = user_data_dir(appname, appauthor, version, env=env, home=home)
         version = False
         if opinion:
             path = os.path.join(path, "Logs")
     else:
-        path = user_cache_dir(appname, appauthor, version)
+        path = user_cache_dir(appname, appauthor, version, env=env, home=home)
         version = False
         if opinion:
             path = os.path.join(path, "log")
@@ -404,54 +550,2250 @@ def user_log_dir(appname=None, appauthor=None, version=None, opinion=True):
     return path
 
 
+def user_runtime_dir(appname=None, appauthor=None, version=None,
+                     env=None, home=None):
+    r"""Return full path to the user-specific runtime dir for this application.
+
+        "appname" is the name of application.
+            If None, just the system directory is returned.
+        "appauthor" (only used on Windows) is the name of the
+            appauthor or distributing body for this application. Typically
+            it is the owning company name. This falls back to appname. You may
+            pass False to disable it.
+        "version" is an optional version path element to append to the
+            path. You might want to use this if you want multiple versions
+            of your app to be able to run independently. If used, this
+            would typically be "<major>.<minor>".
+            Only applied when appname is present.
+        "env" is an optional mapping of environment variables (e.g.
+            XDG_DATA_HOME) to use instead of `os.environ`.
+        "home" is an optional home dir to use for "~", e.g. for another
+            user. It defaults to env["HOME"], if given, else to the
+            current user's home dir.
+
+    Typical user runtime directories are:
+        Mac OS X:   ~/Library/Caches/TemporaryItems/<AppName>
+        Unix:       /run/user/<uid>/<AppName>   # i.e. in $XDG_RUNTIME_DIR
+        Win *:      C:\Users\<username>\AppData\Local\<AppAuthor>\<AppName>\Temp
+
+    The runtime dir is for sockets, pid files, locks and other small files
+    that only matter while the user is logged in. On Unix it is usually on
+    tmpfs. If $XDG_RUNTIME_DIR is not set, "$TMPDIR/runtime-<uid>" (or
+    "/tmp/runtime-<uid>") is used instead; create the dir with
+    `AppDirs.ensure()`, which makes that fallback private (mode 0700) and
+    refuses to use it if someone else owns it.
+    """
+    if system == "win32":
+        path = user_data_dir(appname, appauthor, None, env=env, home=home)
+        if appname:
+            path = os.path.join(path, "Temp")
+    elif system == 'darwin':
+        path = _expanduser('~/Library/Caches/TemporaryItems', env, home)
+        if appname:
+            path = os.path.join(path, appname)
+    else:
+        path = _env_get(env, 'XDG_RUNTIME_DIR') or _runtime_fallback(env)
+        if appname:
+            path = os.path.join(path, appname)
+    if appname and version:
+        path = os.path.join(path, version)
+    return path
+
+
+def resolve_many(apps, kinds=None):
+    r"""Resolve dirs for many applications at once.
+
+        "apps" is an iterable of `AppDirs` instances or of argument tuples
+            for `AppDirs`, e.g. ("MyApp", "MyCompany", "1.0"). Apps with
+            an explicit "env" or "home" are resolved in those.
+        "kinds" is an optional sequence of dir kinds, e.g.
+            ("user_data_dir", "site_data_dir"). By default all kinds are
+            resolved.
+
+    The platform base dirs (expanded home paths, the split XDG_DATA_DIRS,
+    Windows known folders, ...) are computed once and only the per-app
+    suffixes are joined for each app. Returns a list with one result per
+    app: an `AppDirsLayout` if "kinds" is None, otherwise a tuple of the
+    requested paths in the order given.
+    """
+    if kinds is not None:
+        unknown = [kind for kind in kinds if kind not in _KINDS]
+        if unknown:
+            raise ValueError("unknown dir kind(s): %s" % ", ".join(unknown))
+        indices = [_KINDS.index(kind) for kind in kinds]
+    roots = {}
+    results = []
+    for app in apps:
+        if not isinstance(app, AppDirs) and len(app) > 5:
+            app = AppDirs(*app)
+        if isinstance(app, AppDirs):
+            key, app = app._args[5:], app._args[:5]
+        else:
+            key = (None, None)
+        try:
+            app_roots = roots[key]
+        except KeyError:
+            env = None if key[0] is None else dict(key[0])
+            app_roots = roots[key] = _platform_roots(env, key[1])
+        layout = _app_layout(app_roots, *app)
+        if kinds is not None:
+            layout = tuple([layout[i] for i in indices])
+        results.append(layout)
+    return results
+
+
+def resolve_users(users, appname=None, appauthor=None, version=None,
+                  roaming=False, multipath=False, kinds=None):
+    r"""Resolve one application's dirs for many users at once.
+
+        "users" is an iterable of home dirs, or of (home, env) pairs where
+            "env" is a mapping of that user's environment variables (e.g.
+            XDG_CONFIG_HOME), or None.
+        "kinds" is as for `resolve_many()`; the other arguments are as for
+            `AppDirs`.
+
+    Nothing is read from the current process' environment: variables a
+    user's "env" does not set take their default values. Users with the
+    same environment share the work of splitting XDG_*_DIRS. Returns a
+    list with one result per user, as `resolve_many()` does. Not
+    available on Windows, where dirs come from the current user's known
+    folders.
+    """
+    if system == "win32":
+        raise NotImplementedError("resolve_users() is not available on Windows")
+    if kinds is not None:
+        unknown = [kind for kind in kinds if kind not in _KINDS]
+        if unknown:
+            raise ValueError("unknown dir kind(s): %s" % ", ".join(unknown))
+        indices = [_KINDS.index(kind) for kind in kinds]
+    split_dirs = {}
+    results = []
+    for user in users:
+        if isinstance(user, tuple):
+            home, env = user
+        else:
+            home, env = user, None
+        env = env or {}
+        roots = _platform_roots(env, home, split_dirs)
+        layout = _app_layout(roots, appname, appauthor, version, roaming,
+                             multipath)
+        if kinds is not None:
+            layout = tuple([layout[i] for i in indices])
+        results.append(layout)
+    return results
+
+
 class AppDirs(object):
-    """Convenience wrapper for getting application dirs."""
+    """Convenience wrapper for getting application dirs.
+
+    Instances are immutable and hashable; two instances with the same
+    arguments compare equal. Use `AppDirs.shared()` to get a single
+    process-wide instance per set of arguments, so that its caches are
+    shared too.
+
+    "env" and "home" resolve the dirs in the given environment and home
+    dir instead of the current process' (see `user_data_dir()`), e.g.
+    for another user; `resolve_users()` does so for many users at once.
+
+    Resolved paths are cached per instance. The cache is keyed on the
+    environment variables listed in `_ENV_VARS` and on `system`, so it is
+    dropped automatically whenever one of those changes. Use
+    `clear_cache()` to drop it explicitly; `cache_hits` and `cache_misses`
+    count cached lookups.
+    """
+    # Seconds between checks of the dirs searched by `find_data_file()`
+    # and `find_config_file()` for changes.
+    find_recheck_interval = 1.0
+
+    _shared = None  # WeakValueDictionary of `shared()` instances
+
     def __init__(self, appname=None, appauthor=None, version=None,
-            roaming=False, multipath=False):
-        self.appname = appname
-        self.appauthor = appauthor
-        self.version = version
-        self.roaming = roaming
-        self.multipath = multipath
+            roaming=False, multipath=False, env=None, home=None):
+        self._args = (appname, appauthor, version, roaming, multipath,
+                      _env_items(env), home)
+        self._env = None if env is None else dict(self._args[5])
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = {}
+        self._cache_key = None
+        self._ensured = set()
+        self._usage_cache = {}
+
+    @classmethod
+    def shared(cls, appname=None, appauthor=None, version=None,
+               roaming=False, multipath=False, env=None, home=None):
+        """Return the process-wide instance for these arguments.
+
+        The instance is created on first use and kept for as long as it is
+        referenced anywhere (the registry only holds weak references).
+        """
+        key = (cls, appname, appauthor, version, roaming, multipath,
+               _env_items(env), home)
+        with _shared_lock:
+            if AppDirs._shared is None:
+                import weakref
+                AppDirs._shared = weakref.WeakValueDictionary()
+            instance = AppDirs._shared.get(key)
+            if instance is None:
+                instance = AppDirs._shared[key] = cls(
+                    appname, appauthor, version, roaming, multipath, env, home)
+            return instance
+
+    appname = property(lambda self: self._args[0])
+    appauthor = property(lambda self: self._args[1])
+    version = property(lambda self: self._args[2])
+    roaming = property(lambda self: self._args[3])
+    multipath = property(lambda self: self._args[4])
+    env = property(lambda self: None if self._env is None else dict(self._env),
+                   doc="Copy of the explicit environment variables, or None.")
+    home = property(lambda self: self._args[6])
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._args == other._args
+
+    def __ne__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._args != other._args
+
+    def __hash__(self):
+        return hash(self._args)
+
+    def __repr__(self):
+        extra = ""
+        if self._env is not None:
+            extra += ", env=%r" % (self._env,)
+        if self.home is not None:
+            extra += ", home=%r" % (self.home,)
+        return "%s(%r, %r, %r, %r, %r%s)" % (
+            (type(self).__name__,) + self._args[:5] + (extra,))
+
+    def clear_cache(self):
+        """Drop all cached paths and reset the hit/miss counters.
+
+        This also forgets which dirs `ensure()` has already created.
+        """
+        self._cache = {}
+        self._cache_key = None
+        self._ensured = set()
+        self._usage_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def resolve_all(self):
+        """Resolve every kind of dir in one pass.
+
+        Returns an `AppDirsLayout` namedtuple. Each environment variable
+        is read, and "~" expanded, only once.
+        """
+        cache = self._current_cache()
+        try:
+            layout = cache["layout"]
+        except KeyError:
+            self.cache_misses += 1
+            layout = cache["layout"] = _app_layout(
+                _platform_roots(self._env, self.home), self.appname, self.appauthor,
+                self.version, self.roaming, self.multipath)
+            cache.update(zip(_KINDS, layout))
+            return layout
+        self.cache_hits += 1
+        return layout
+
+    def ensure(self, kinds=None, mode=0o777):
+        """Create the dirs of the given kinds if they do not exist yet.
+
+            "kinds" is an optional sequence of dir kinds. By default all
+                user_* dirs are created.
+            "mode" is passed to `os.mkdir` for each dir that is created.
+
+        Parent dirs shared between kinds are only checked once, and dirs
+        already created or found by an earlier call are not checked again.
+        It is safe for several processes to create the same tree at the
+        same time. Returns the list of ensured paths.
+        """
+        if kinds is None:
+            kinds = _USER_KINDS
+        layout = self.resolve_all()
+        paths = []
+        for kind in kinds:
+            if kind not in _KINDS:
+                raise ValueError("unknown dir kind: %s" % kind)
+            path = getattr(layout, kind)
+            if kind.startswith("site_") and self.multipath:
+                paths.extend(path.split(os.pathsep))
+            else:
+                paths.append(path)
+            if kind == "user_runtime_dir" and path not in self._ensured:
+                _secure_runtime_fallback(path, self._env, self._ensured)
+        for path in paths:
+            _makedirs(path, mode, self._ensured)
+        return paths
+
+    def find_data_file(self, name):
+        """Return the path of the first data file called "name", or None.
+
+        "name" is relative, e.g. "icons/app.png". The user data dir is
+        searched first, then each site data dir in XDG_DATA_DIRS order.
+        See `find_config_file()` for how results are cached.
+        """
+        return self._finder("data").find(name)
+
+    def find_config_file(self, name):
+        """Return the path of the first config file called "name", or None.
+
+        "name" is relative, e.g. "settings.ini". The user config dir is
+        searched first, then each site config dir in XDG_CONFIG_DIRS order.
+
+        Hits and misses are both cached. The searched dirs are re-checked
+        (one stat each) at most every `find_recheck_interval` seconds, and
+        the cached results are dropped if any of their mtimes changed.
+        """
+        return self._finder("config").find(name)
+
+    def _finder(self, what):
+        cache = self._current_cache()
+        key = "finder:" + what
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        layout = _app_layout(_platform_roots(self._env, self.home),
+                             self.appname, self.appauthor, self.version,
+                             self.roaming, multipath=True)
+        user_dir = getattr(layout, "user_%s_dir" % what)
+        site_dirs = getattr(layout, "site_%s_dir" % what)
+        if system in ("win32", "darwin"):
+            site_dirs = [site_dirs]
+        else:
+            site_dirs = site_dirs.split(os.pathsep)
+        finder = cache[key] = _FileFinder([user_dir] + site_dirs,
+                                          self.find_recheck_interval)
+        return finder
+
+    def cache_manager(self, max_bytes=None, max_files=None):
+        """Return a `CacheManager` bounding the user cache dir.
+
+        On Unix the user log dir lives under the cache dir; it is never
+        evicted from, and neither are `cache_store()` databases.
+        """
+        layout = self.resolve_all()
+        exclude = []
+        log_relpath = os.path.relpath(layout.user_log_dir, layout.user_cache_dir)
+        if not log_relpath.startswith(os.pardir):
+            exclude.append(log_relpath)
+        exclude.append(CacheStore.STORE_DIR)
+        return CacheManager(layout.user_cache_dir, max_bytes, max_files,
+                            exclude=exclude)
+
+    def cache_store(self, name, hot_size=1024):
+        """Return a persistent key-value `CacheStore` in the user cache dir.
+
+            "name" names the store; stores with different names are
+                independent.
+            "hot_size" is the number of entries kept in memory by this
+                process (see `CacheStore`); 0 disables the hot tier.
+
+        The store is an SQLite database in the ".appdirs-stores" subdir of
+        the user cache dir, which is created if needed. Requires the
+        `sqlite3` module.
+        """
+        storedir = os.path.join(self.ensure(["user_cache_dir"])[0],
+                                CacheStore.STORE_DIR)
+        _makedirs(storedir, 0o777, set())
+        return CacheStore(os.path.join(storedir, _check_name(name) + ".sqlite"),
+                          hot_size)
+
+    def blob_store(self, kind="user_data_dir", name="blobs",
+                   algorithm="sha256"):
+        """Return a content-addressed `BlobStore` in a user dir.
+
+            "kind" is the user dir kind holding the store, e.g.
+                "user_data_dir" (the default) or "user_cache_dir".
+            "name" is the store's subdir in that dir.
+            "algorithm" is the `hashlib` algorithm naming the blobs.
+
+        The store dir is created if needed.
+        """
+        root = os.path.join(self._user_dir(kind), _check_name(name))
+        _makedirs(os.path.join(root, BlobStore.TMP_DIR), 0o777, set())
+        return BlobStore(root, algorithm)
+
+    def log_retention(self, max_age=None, max_bytes=None, compress=True):
+        """Return a `LogRetention` managing the user log dir."""
+        return LogRetention(self.user_log_dir, max_age, max_bytes, compress)
+
+    def lock(self, kind, name, shared=False, timeout=None):
+        """Return a cross-process `FileLock` named "name" in a user dir.
+
+            "kind" is the user dir kind holding the lock file, e.g.
+                "user_cache_dir" or "user_state_dir".
+            "name" is the lock name; the lock file is "<name>.lock".
+            "shared" requests a shared (reader) lock instead of an
+                exclusive (writer) one.
+            "timeout" is the number of seconds to wait for the lock; None
+                waits forever and 0 fails at once.
+
+        The dir is created if needed. Use the result as a context manager:
+
+            >>> with dirs.lock("user_cache_dir", "index"):
+            ...     rebuild_index()
+
+        Locks are advisory `fcntl.flock` locks, so they only exclude other
+        users of the same lock file, and are released when the process
+        exits. Raises NotImplementedError where `fcntl` is not available
+        (e.g. on Windows).
+        """
+        try:
+            import fcntl
+        except ImportError:
+            raise NotImplementedError("file locks require fcntl")
+        lockdir = self._user_dir(kind)
+        return FileLock(os.path.join(lockdir, _check_name(name) + ".lock"),
+                        shared, timeout)
+
+    def write_atomic(self, kind, name, data, durable=True):
+        """Atomically replace the file "name" in a user dir with "data".
+
+            "kind" is the user dir kind, e.g. "user_state_dir".
+            "data" is bytes, or text to be written as UTF-8.
+            "durable", if true (the default), fsyncs the file and then the
+                dir, so the new content survives a crash once this returns.
+
+        The data is written to a temp file which is then renamed over the
+        target, so readers (and a crash) only ever see the old or the new
+        content, never a partial file. An existing target keeps its
+        permissions. The dir is created if needed. To write many files,
+        use `atomic_writes()`, which shares the syncs.
+        """
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        userdir = self._user_dir(kind)
+        target = os.path.join(userdir, _check_name(name))
+        _replace(_write_temp(target, data, durable, keep_mode=True), target)
+        if durable:
+            _fsync_dir(userdir)
+
+    def atomic_writes(self, kind, durable=True):
+        """Return an `AtomicWriteBatch` for group commits in a user dir.
+
+        Use it as a context manager:
+
+            >>> with dirs.atomic_writes("user_state_dir") as batch:
+            ...     batch.write("a.json", a)
+            ...     batch.write("b.json", b)
+
+        All files are replaced when the block exits without an exception,
+        with a single dir fsync for the whole batch; if it raises, nothing
+        is replaced. See `write_atomic()` for the arguments.
+        """
+        return AtomicWriteBatch(self._user_dir(kind), durable)
+
+    def _user_dir(self, kind):
+        if kind not in _USER_KINDS:
+            raise ValueError("not a user dir kind: %s" % kind)
+        path = self.ensure([kind])[0]
+        if not os.path.isdir(path):
+            # Removed since ensure() saw it (e.g. a cleaned runtime or cache
+            # dir): forget every dir it remembered and create them again.
+            self._ensured.clear()
+            path = self.ensure([kind])[0]
+        return path
+
+    def log_handler(self, filename=None, batch_size=256, max_queue=10000):
+        """Return a non-blocking `logging.Handler` writing to the user log dir.
+
+            "filename" is the log file name; it defaults to "<appname>.log".
+            "batch_size" is the maximum number of records written (and
+                flushed) together.
+            "max_queue" is the maximum number of records waiting to be
+                written; logging threads block while the queue is full.
+
+        The log dir is created if needed. Logging threads only format the
+        record and put it on a queue; a single writer thread appends queued
+        records to the file in batches, flushing once per batch. Write
+        errors go to the handler's `handleError()`. Call the handler's
+        `close()` (`logging.shutdown()` does) to write out pending records
+        and stop the writer thread.
+        """
+        logdir = self.ensure(["user_log_dir"])[0]
+        path = os.path.join(logdir, filename or "%s.log" % (self.appname or "app"))
+        return _queue_log_handler_class()(path, batch_size, max_queue)
+
+    def usage(self, kinds=None, max_workers=8):
+        """Return the disk usage of each kind of dir.
+
+            "kinds" is an optional sequence of dir kinds; all by default.
+                The site dirs are summed over every XDG_*_DIRS entry.
+            "max_workers" is the size of the thread pool walking the dirs.
+
+        Returns a dict mapping each kind to a `DiskUsage(bytes, files)`
+        namedtuple; missing dirs count as empty. Dirs nested in another
+        kind's dir (e.g. the log dir under the cache dir on Unix) are
+        counted in both.
+
+        Dir listings are cached by mtime, so repeated calls only list dirs
+        that changed; every dir and file is still stat'ed, so files that
+        grow or shrink in place are counted correctly.
+        """
+        from multiprocessing.pool import ThreadPool
+        if kinds is None:
+            kinds = _KINDS
+        layout = _app_layout(_platform_roots(self._env, self.home),
+                             self.appname, self.appauthor, self.version,
+                             self.roaming, multipath=True)
+        tasks = []
+        for kind in kinds:
+            if kind not in _KINDS:
+                raise ValueError("unknown dir kind: %s" % kind)
+            path = getattr(layout, kind)
+            if kind.startswith("site_") and system not in ("win32", "darwin"):
+                tasks.extend((kind, p) for p in path.split(os.pathsep))
+            else:
+                tasks.append((kind, path))
+        pool = ThreadPool(max(1, min(max_workers, len(tasks))))
+        try:
+            totals = pool.map(
+                lambda task: _dir_usage(task[1], self._usage_cache), tasks)
+        finally:
+            pool.close()
+        usage = dict((kind, DiskUsage(0, 0)) for kind in kinds)
+        for (kind, _), (nbytes, nfiles) in zip(tasks, totals):
+            usage[kind] = DiskUsage(usage[kind].bytes + nbytes,
+                                    usage[kind].files + nfiles)
+        return usage
+
+    def export_layout(self, path):
+        """Write every resolved dir to the file "path" for `load_layout()`.
+
+        Meant for environments that do not change between runs, e.g. at
+        container image build time. The file also records the arguments
+        and a fingerprint of the environment the dirs were resolved in.
+        It uses the `marshal` format, so read it with the same Python
+        version.
+        """
+        import marshal
+        data = marshal.dumps((_LAYOUT_MAGIC, self._args,
+                              _portable_fingerprint(),
+                              tuple(self.resolve_all())))
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        _replace(tmp_path, path)
+
+    def load_layout(self, path):
+        """Use the dirs saved by `export_layout()`, if they still apply.
+
+        If the file at "path" was exported for the same arguments and the
+        current environment matches the recorded fingerprint, all dirs are
+        taken from it and no resolution happens. Otherwise (including when
+        the file is missing or unreadable) nothing changes and dirs are
+        resolved as usual. Returns True if the file was used.
+        """
+        import marshal
+        # os.read() skips the buffered file object; this file is tiny.
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                chunks = []
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            finally:
+                os.close(fd)
+            magic, args, fingerprint, layout = marshal.loads(b"".join(chunks))
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+        if (magic != _LAYOUT_MAGIC or tuple(args) != self._args or
+                tuple(fingerprint) != _portable_fingerprint() or
+                len(layout) != len(_KINDS)):
+            return False
+        cache = self._current_cache()
+        cache["layout"] = AppDirsLayout(*layout)
+        cache.update(zip(_KINDS, layout))
+        return True
+
+    def as_dict(self):
+        """Return a dict mapping each kind of dir to its path."""
+        return dict(zip(_KINDS, self.resolve_all()))
+
+    def _current_cache(self):
+        key = _env_fingerprint()
+        if key != self._cache_key:
+            self._cache = {}
+            self._cache_key = key
+        return self._cache
+
+    def _cached(self, kind, func, **kwargs):
+        cache = self._current_cache()
+        try:
+            path = cache[kind]
+        except KeyError:
+            self.cache_misses += 1
+            path = cache[kind] = func(self.appname, self.appauthor,
+                                      version=self.version, env=self._env,
+                                      home=self.home, **kwargs)
+            return path
+        self.cache_hits += 1
+        return path
 
     @property
     def user_data_dir(self):
-        return user_data_dir(self.appname, self.appauthor,
-                             version=self.version, roaming=self.roaming)
+        return self._cached("user_data_dir", user_data_dir,
+                            roaming=self.roaming)
 
     @property
     def site_data_dir(self):
-        return site_data_dir(self.appname, self.appauthor,
-                             version=self.version, multipath=self.multipath)
+        return self._cached("site_data_dir", site_data_dir,
+                            multipath=self.multipath)
 
     @property
     def user_config_dir(self):
-        return user_config_dir(self.appname, self.appauthor,
-                               version=self.version, roaming=self.roaming)
+        return self._cached("user_config_dir", user_config_dir,
+                            roaming=self.roaming)
 
     @property
     def site_config_dir(self):
-        return site_config_dir(self.appname, self.appauthor,
-                             version=self.version, multipath=self.multipath)
+        return self._cached("site_config_dir", site_config_dir,
+                            multipath=self.multipath)
 
     @property
     def user_cache_dir(self):
-        return user_cache_dir(self.appname, self.appauthor,
-                              version=self.version)
+        return self._cached("user_cache_dir", user_cache_dir)
 
     @property
     def user_state_dir(self):
-        return user_state_dir(self.appname, self.appauthor,
-                              version=self.version)
+        return self._cached("user_state_dir", user_state_dir)
 
     @property
     def user_log_dir(self):
-        return user_log_dir(self.appname, self.appauthor,
-                            version=self.version)
+        return self._cached("user_log_dir", user_log_dir)
+
+    @property
+    def user_runtime_dir(self):
+        return self._cached("user_runtime_dir", user_runtime_dir)
+
+
+class AppPaths(object):
+    """Like `AppDirs`, but with precomputed, immutable `pathlib.Path` attributes.
+
+    Every kind of dir is resolved once, when the instance is created, so
+    attribute access is free; create a new instance to pick up environment
+    changes. `site_data_dir` and `site_config_dir` are the first site dirs;
+    `site_data_dirs` and `site_config_dirs` are tuples of all of them (see
+    the "multipath" option of `site_data_dir()`). Requires Python 3.4+.
+    """
+    __slots__ = _KINDS + ("appname", "appauthor", "version", "roaming",
+                          "site_data_dirs", "site_config_dirs")
+
+    def __init__(self, appname=None, appauthor=None, version=None,
+                 roaming=False, env=None, home=None):
+        from pathlib import Path
+        layout = _app_layout(_platform_roots(env, home), appname, appauthor,
+                             version, roaming, multipath=True)
+        init = object.__setattr__
+        for name, value in (("appname", appname), ("appauthor", appauthor),
+                            ("version", version), ("roaming", roaming)):
+            init(self, name, value)
+        for kind, path in zip(_KINDS, layout):
+            if kind.startswith("site_"):
+                if system in ("win32", "darwin"):
+                    paths = (Path(path),)
+                else:
+                    paths = tuple(Path(p) for p in path.split(os.pathsep))
+                init(self, kind + "s", paths)
+                init(self, kind, paths[0])
+            else:
+                init(self, kind, Path(path))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    __delattr__ = __setattr__
+
+    def __repr__(self):
+        return "%s(%r, %r, %r, %r)" % (type(self).__name__, self.appname,
+                                       self.appauthor, self.version,
+                                       self.roaming)
+
+    def joinpath(self, kind, *parts):
+        """Return the dir of the given kind joined with "parts".
+
+            >>> AppPaths("SuperApp").joinpath("user_data_dir", "db", "main.db")
+            PosixPath('/home/trentm/.local/share/SuperApp/db/main.db')
+        """
+        if kind not in _KINDS:
+            raise ValueError("unknown dir kind: %s" % kind)
+        return getattr(self, kind).joinpath(*parts)
+
+
+class ConfigIndex(object):
+    """Index of config files layered across the user and site config dirs.
+
+    Maps each config file name, relative to the config dirs (e.g.
+    "plugins/foo.ini"), to a (path, shadowed) tuple: "path" is the file
+    that wins and "shadowed" lists the lower-precedence files it hides.
+    The user config dir wins over the site config dirs, which are layered
+    in XDG_CONFIG_DIRS order.
+
+        >>> index = ConfigIndex(AppDirs("SuperApp", "Acme"))
+        >>> index["settings.ini"]
+        ('/home/trentm/.config/SuperApp/settings.ini', ('/etc/xdg/SuperApp/settings.ini',))
+
+    Call `refresh()` to pick up changes. Each dir in the trees is stat'ed,
+    but only dirs whose mtime changed are listed again. Symlinked dirs are
+    followed (as `find_config_file()` does), except back into a dir they
+    are in.
+    """
+    def __init__(self, dirs):
+        layout = _app_layout(_platform_roots(dirs._env, dirs.home),
+                             dirs.appname, dirs.appauthor, dirs.version,
+                             dirs.roaming, multipath=True)
+        site_dirs = layout.site_config_dir
+        if system in ("win32", "darwin"):
+            site_dirs = [site_dirs]
+        else:
+            site_dirs = site_dirs.split(os.pathsep)
+        self.layers = [layout.user_config_dir] + site_dirs
+        self._scanner = _DirScanner(follow_symlinks=True)
+        self._listings = []
+        self._index = {}
+        self.refresh()
+
+    def refresh(self):
+        """Rescan the config trees and rebuild the index if anything changed."""
+        listings = []
+        for layer in self.layers:
+            # Each entry carries the ids of the dirs above it, so a symlink
+            # back to one of them is not followed round in circles.
+            stack = [("", ())]
+            while stack:
+                reldir, parents = stack.pop()
+                listing = self._scanner.scan(os.path.join(layer, reldir))
+                if listing is None or listing[3] in parents:
+                    continue
+                listings.append((layer, reldir, listing))
+                parents += (listing[3],)
+                stack.extend((os.path.join(reldir, name), parents)
+                             for name in listing[2])
+        # Unchanged dirs give back the very same listing objects, so this
+        # comparison is cheap when nothing changed.
+        if listings == self._listings:
+            return
+        self._listings = listings
+        found = {}
+        for layer, reldir, listing in listings:
+            for name in listing[1]:
+                relname = os.path.join(reldir, name)
+                found.setdefault(relname, []).append(
+                    os.path.join(layer, relname))
+        self._index = dict((relname, (paths[0], tuple(paths[1:])))
+                           for relname, paths in found.items())
+
+    def __getitem__(self, relname):
+        return self._index[os.path.normpath(relname)]
+
+    def __contains__(self, relname):
+        return os.path.normpath(relname) in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, relname, default=None):
+        return self._index.get(os.path.normpath(relname), default)
+
+    def items(self):
+        return self._index.items()
+
+
+class _PeriodicTask(object):
+    """Mixin that calls `self.run_once()` periodically in a daemon thread."""
+    _thread = None
+
+    def start(self, interval):
+        """Call `run_once()` every "interval" seconds in a background thread."""
+        import threading
+        if self._thread is not None:
+            raise RuntimeError("%s already started" % type(self).__name__)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                        name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread started by `start()`, if any."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _loop(self, interval):
+        stopping = self._stopping
+        while True:
+            # Event.wait() only returns the flag from Python 2.7 on.
+            stopping.wait(interval)
+            if stopping.is_set():
+                return
+            try:
+                self.run_once()
+            except (IOError, OSError):
+                # Usually transient (e.g. a file removed under us); retry
+                # on the next tick rather than losing the thread.
+                pass
+
+
+class CacheManager(_PeriodicTask):
+    """Bounds a cache dir by total size and file count, evicting LRU files.
+
+        "path" is the cache dir, usually `AppDirs.user_cache_dir`.
+        "max_bytes" and "max_files" are the quotas; None means unbounded.
+        "exclude" lists paths, relative to "path", that are never evicted.
+
+    Sizes and last-use times are kept in a small index file in the cache
+    dir. `usage()` and `enforce()` first pick up files added, removed,
+    replaced or resized by anyone: every dir and file in the tree is
+    stat'ed, but only dirs whose mtime changed since the last call are
+    listed again (the first call in a process lists them all). Report
+    files that are read with `touch()` so they count as recently used;
+    `rebuild()` re-syncs the whole index with the tree. Use `start(interval)` to
+    enforce the quotas from a background thread.
+    """
+    INDEX_NAME = ".appdirs-cache-index"
+
+    def __init__(self, path, max_bytes=None, max_files=None, exclude=()):
+        import threading
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.exclude = set(os.path.normpath(p) for p in exclude)
+        self.exclude.add(self.INDEX_NAME)
+        self._lock = threading.Lock()
+        self._entries = None  # relpath -> [size, last_used]
+        self._scanner = _DirScanner()
+        self._dir_files = None  # reldir -> files listed at the last sync
+
+    def touch(self, relpath):
+        """Record that the file at "relpath" was just written or used."""
+        relpath = os.path.normpath(relpath)
+        try:
+            size = os.stat(os.path.join(self.path, relpath)).st_size
+        except OSError:
+            size = None
+        with self._lock:
+            entries = self._load()
+            if size is None:
+                entries.pop(relpath, None)
+            else:
+                entries[relpath] = [size, time.time()]
+
+    def usage(self):
+        """Return (total bytes, file count) of the cache dir."""
+        with self._lock:
+            entries = self._sync()
+            return sum(e[0] for e in entries.values()), len(entries)
+
+    def enforce(self):
+        """Evict least-recently-used files until within the quotas.
+
+        Returns the list of evicted relative paths.
+        """
+        with self._lock:
+            entries = self._sync()
+            total = sum(e[0] for e in entries.values())
+            count = len(entries)
+            evicted = []
+            if self._over(total, count):
+                for relpath, (size, _) in sorted(entries.items(),
+                                                 key=lambda item: item[1][1]):
+                    if not self._over(total, count):
+                        break
+                    try:
+                        os.remove(os.path.join(self.path, relpath))
+                    except OSError:
+                        if os.path.exists(os.path.join(self.path, relpath)):
+                            continue
+                    del entries[relpath]
+                    total -= size
+                    count -= 1
+                    evicted.append(relpath)
+            self._save()
+            return evicted
+
+    run_once = enforce
+
+    def rebuild(self):
+        """Rebuild the index from a (streaming) walk of the cache dir.
+
+        Files already in the index keep their last-use time; new files
+        get their atime or mtime, whichever is later.
+        """
+        with self._lock:
+            self._rebuild()
+            self._dir_files = None
+
+    def _over(self, total, count):
+        return ((self.max_bytes is not None and total > self.max_bytes) or
+                (self.max_files is not None and count > self.max_files))
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self._read_index()
+            if self._entries is None:
+                self._rebuild()
+        return self._entries
+
+    def _sync(self):
+        """Update the index with the files now in the tree."""
+        entries = self._load()
+        dir_files = self._dir_files
+        if dir_files is None:
+            dir_files = self._dir_files = {}
+            for relpath in entries:
+                reldir, name = os.path.split(relpath)
+                dir_files.setdefault(reldir, set()).add(name)
+        seen = set()
+        stack = [""]
+        while stack:
+            reldir = stack.pop()
+            listing = self._scanner.scan(os.path.join(self.path, reldir))
+            if listing is None:
+                continue
+            seen.add(reldir)
+            files, subdirs = listing[1], listing[2]
+            for name in subdirs:
+                relsub = os.path.join(reldir, name)
+                if relsub not in self.exclude:
+                    stack.append(relsub)
+            old = dir_files.get(reldir, ())
+            if old is not files:
+                for name in old:
+                    if name not in files:
+                        entries.pop(os.path.join(reldir, name), None)
+                dir_files[reldir] = files
+            # Files replaced by a rename or rewritten in place keep their
+            # names, so every file is lstat'ed, not just new names.
+            for name in files:
+                relpath = os.path.join(reldir, name)
+                if relpath in self.exclude or name.startswith(self.INDEX_NAME):
+                    continue
+                try:
+                    st = os.lstat(os.path.join(self.path, relpath))
+                except OSError:
+                    entries.pop(relpath, None)
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                entry = entries.get(relpath)
+                if entry is None:
+                    entries[relpath] = [st.st_size,
+                                        max(st.st_atime, st.st_mtime)]
+                else:
+                    entry[0] = st.st_size
+                    entry[1] = max(entry[1], st.st_mtime)
+        for reldir in list(dir_files):
+            if reldir not in seen:
+                for name in dir_files.pop(reldir):
+                    entries.pop(os.path.join(reldir, name), None)
+        return entries
+
+    def _rebuild(self):
+        old = self._entries or self._read_index() or {}
+        entries = {}
+        for relpath, st in _iter_files(self.path, self.exclude):
+            last_used = max(st.st_atime, st.st_mtime)
+            if relpath in old:
+                last_used = max(last_used, old[relpath][1])
+            entries[relpath] = [st.st_size, last_used]
+        self._entries = entries
+        self._save()
+
+    def _read_index(self):
+        import json
+        try:
+            with open(os.path.join(self.path, self.INDEX_NAME)) as f:
+                return json.load(f)["files"]
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self):
+        import json
+        if not os.path.isdir(self.path):
+            return
+        index_path = os.path.join(self.path, self.INDEX_NAME)
+        tmp_path = "%s.%d.tmp" % (index_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "files": self._entries}, f,
+                      separators=(",", ":"))
+        _replace(tmp_path, index_path)
+
+
+class LogRetention(_PeriodicTask):
+    """Compresses, ages out and size-bounds rotated log files in a log dir.
+
+        "path" is the log dir, usually `AppDirs.user_log_dir`.
+        "max_age" is the age in seconds after which rotated files are
+            deleted; None keeps them forever.
+        "max_bytes" bounds the total size of the dir by deleting the oldest
+            rotated files; None means unbounded.
+        "compress" (boolean, default True) gzips rotated files.
+
+    Only rotated files (see `is_rotated()`) are touched; the files being
+    logged to are counted towards "max_bytes" but never modified. Call
+    `run_once()` directly, or `start(interval)` to run it in a background
+    thread so the threads doing the logging never wait on it.
+
+    The dir is only re-listed when its mtime changes. Its files are
+    stat'ed on every cycle, as rotating handlers reuse names: after a
+    rollover "app.log.1" is a different, newer file.
+    """
+    def __init__(self, path, max_age=None, max_bytes=None, compress=True):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._scanner = _DirScanner()
+        self._stats = {}  # rotated file name -> (size, mtime), this cycle
+
+    def is_rotated(self, name):
+        """Return True if "name" is a rotated log file.
+
+        This matches the names used by the `logging.handlers` rotating
+        handlers, e.g. "app.log.1", "app.log.2017-04-29_10-00" and, once
+        compressed, "app.log.1.20170429-100000.gz", but not other files
+        such as "app.log.lock". Override to match other schemes.
+        """
+        base, sep, suffix = name.partition(".log.")
+        if not base or not sep:
+            return False
+        if suffix.endswith(".gz"):
+            suffix = suffix[:-3]
+        return bool(suffix) and not suffix.strip("0123456789-_.")
+
+    def run_once(self):
+        """Run one retention cycle. Returns (compressed, deleted) name lists."""
+        self._stats = {}
+        listing = self._scanner.scan(self.path)
+        if listing is None:
+            return [], []
+        active_bytes = 0
+        for name in listing[1]:
+            if name.endswith(".tmp"):
+                continue
+            st = self._stat(name)
+            if st is None:
+                continue
+            if self.is_rotated(name):
+                self._stats[name] = (st.st_size, st.st_mtime)
+            else:
+                active_bytes += st.st_size
+
+        # Delete first, so nothing is compressed only to be deleted.
+        deleted = []
+        by_age = sorted(self._stats.items(), key=lambda item: item[1][1])
+        total = active_bytes + sum(size for size, _ in self._stats.values())
+        cutoff = None
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+        for name, (size, mtime) in by_age:
+            too_old = cutoff is not None and mtime < cutoff
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            del self._stats[name]
+            total -= size
+            deleted.append(name)
+
+        compressed = []
+        if self.compress:
+            for name in sorted(self._stats):
+                if not name.endswith(".gz") and self._gzip(name):
+                    compressed.append(name)
+        return compressed, deleted
+
+    def _stat(self, name):
+        try:
+            return os.stat(os.path.join(self.path, name))
+        except OSError:
+            return None
+
+    def _gzip(self, name):
+        """Compress "name" to a new "<name>.<mtime>.gz"; never overwrites.
+
+        Numbered backups ("app.log.1") are reused by the next rollover, so
+        the mtime makes the compressed names unique across generations.
+        """
+        import gzip
+        import shutil
+        src = os.path.join(self.path, name)
+        mtime = self._stats[name][1]
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(mtime))
+        tmp = "%s.%d.gz.tmp" % (src, os.getpid())
+        try:
+            with open(src, "rb") as fin:
+                with gzip.open(tmp, "wb") as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
+            os.utime(tmp, (mtime, mtime))
+            for i in itertools.count():
+                dst_name = "%s.%s%s.gz" % (name, stamp, i and "-%d" % i or "")
+                if _rename_new(tmp, os.path.join(self.path, dst_name)):
+                    break
+            os.remove(src)
+        except (IOError, OSError):
+            _remove_quietly(tmp)
+            return False
+        del self._stats[name]
+        self._stats[dst_name] = (
+            os.path.getsize(os.path.join(self.path, dst_name)), mtime)
+        return True
+
+
+class FileLock(object):
+    """An advisory lock on a file, shared between processes.
+
+    Returned by `AppDirs.lock()`. `acquire()` (or entering a ``with``
+    block) waits up to "timeout" seconds for the lock and raises
+    `LockTimeout` if it is still held by others; `release()` (or leaving
+    the block) releases it. Any number of shared locks can be held at the
+    same time, but an exclusive lock excludes all others. A lock object
+    is not reentrant, and should not be shared between threads.
+    """
+
+    def __init__(self, path, shared=False, timeout=None):
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self._fd = None
+
+    @property
+    def locked(self):
+        """True if this object holds the lock."""
+        return self._fd is not None
+
+    def acquire(self):
+        import fcntl
+        if self._fd is not None:
+            raise RuntimeError("lock already held: %s" % self.path)
+        operation = self.shared and fcntl.LOCK_SH or fcntl.LOCK_EX
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if self.timeout is None:
+                fcntl.flock(fd, operation)
+            else:
+                # flock() has no timeout: poll, backing off up to 50ms.
+                deadline = time.time() + self.timeout
+                delay = 0.0005
+                while True:
+                    try:
+                        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                        break
+                    except (IOError, OSError) as ex:
+                        if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                            raise
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise LockTimeout(errno.EAGAIN,
+                                          "timed out waiting for lock",
+                                          self.path)
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 2, 0.05)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def release(self):
+        if self._fd is None:
+            raise RuntimeError("lock not held: %s" % self.path)
+        fd, self._fd = self._fd, None
+        os.close(fd)  # also releases the lock
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __repr__(self):
+        return "<%s %r %s%s>" % (type(self).__name__, self.path,
+                                 self.shared and "shared" or "exclusive",
+                                 self.locked and " locked" or "")
+
+
+class AtomicWriteBatch(object):
+    """Group commit of atomic file replacements in one dir.
+
+    Returned by `AppDirs.atomic_writes()`. `write()` writes the new
+    content to a temp file next to the target; `commit()` syncs the temp
+    files' data, renames them over their targets and fsyncs the dir once.
+    Syncing all files together at the end lets the filesystem flush them
+    in one journal commit, rather than one per file. Writing the same
+    name twice in a batch only keeps the last content. `abort()` removes
+    the temp files instead. Using the batch as a context manager commits
+    on success and aborts on an exception.
+    """
+
+    def __init__(self, path, durable=True):
+        self.path = path
+        self.durable = durable
+        self._pending = {}
+
+    def write(self, name, data):
+        """Stage "data" (bytes, or text as UTF-8) as the new content of "name"."""
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        target = os.path.join(self.path, _check_name(name))
+        tmp_path = _write_temp(target, data, keep_mode=True)
+        old = self._pending.pop(target, None)
+        self._pending[target] = tmp_path
+        if old is not None:
+            os.remove(old)
+
+    def commit(self):
+        """Replace all staged files; returns the list of replaced paths.
+
+        Each file is replaced atomically, but the batch as a whole is not:
+        if a rename fails, the files renamed before it stay replaced.
+        """
+        pending, self._pending = self._pending, {}
+        done = []
+        try:
+            if self.durable:
+                for tmp_path in pending.values():
+                    _fsync_path(tmp_path)
+            for target, tmp_path in pending.items():
+                _replace(tmp_path, target)
+                done.append(target)
+        except BaseException:
+            self._pending = dict((target, tmp_path)
+                                 for target, tmp_path in pending.items()
+                                 if target not in done)
+            self.abort()
+            raise
+        if self.durable and done:
+            _fsync_dir(self.path)
+        return done
+
+    def abort(self):
+        """Drop all staged files."""
+        pending, self._pending = self._pending, {}
+        for tmp_path in pending.values():
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class CacheStore(object):
+    """A persistent key-value cache, safe to share between processes.
+
+    Returned by `AppDirs.cache_store()`. Keys are strings and values are
+    bytes. Entries are kept in an SQLite database in WAL mode, so readers
+    never block and writers from several processes are serialized; reads
+    go through a memory-mapped view of the database file. Each entry can
+    have a time to live, after which it is no longer returned. Expired
+    entries are deleted when the store is opened and every "PURGE_EVERY"
+    writes, so a store of short-lived entries does not keep growing; call
+    `purge()` to delete them right away.
+
+    The most recently used "hot_size" entries are also kept in an
+    in-process LRU dict. Before using it, each lookup checks SQLite's
+    "data_version", which changes whenever another connection (in this
+    or another process) commits, so the hot tier never serves stale
+    values. A store may be used from several threads. Like all SQLite
+    databases in WAL mode, it must not live on a network filesystem.
+    """
+
+    STORE_DIR = ".appdirs-stores"
+    MMAP_SIZE = 256 * 1024 * 1024
+    BUSY_TIMEOUT = 30.0
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, hot_size=1024):
+        import sqlite3
+        from collections import OrderedDict
+        self.path = path
+        self.hot_size = hot_size
+        self._hot = OrderedDict()
+        self._lock = _allocate_lock()
+        self._writes = 0
+        self._db = db = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT,
+                                        isolation_level=None,
+                                        check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA mmap_size=%d" % self.MMAP_SIZE)
+        db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                   "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_expires "
+                   "ON entries (expires)")
+        self._delete_expired()
+        self._data_version = self._current_data_version()
+
+    def _delete_expired(self):
+        return self._db.execute("DELETE FROM entries WHERE expires <= ?",
+                                (time.time(),)).rowcount
+
+    def _current_data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_hot(self):
+        data_version = self._current_data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._hot.clear()
+
+    def _remember(self, key, value, expires):
+        hot = self._hot
+        hot[key] = (value, expires)
+        if len(hot) > self.hot_size:
+            hot.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the value for "key", or "default" if missing or expired."""
+        now = time.time()
+        with self._lock:
+            self._check_hot()
+            entry = self._hot.get(key)
+            if entry is None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM entries WHERE key = ?",
+                    (key,)).fetchone()
+                if row is None:
+                    return default
+                entry = (bytes(row[0]), row[1])
+                if self.hot_size:
+                    self._remember(key, *entry)
+            else:
+                self._hot[key] = self._hot.pop(key)
+        value, expires = entry
+        if expires is not None and expires <= now:
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store the bytes "value" for "key", expiring after "ttl" seconds."""
+        import sqlite3
+        expires = ttl is not None and time.time() + ttl or None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                             (key, sqlite3.Binary(value), expires))
+            self._writes += 1
+            if self._writes >= self.PURGE_EVERY:
+                # Expired entries in the hot tier are never returned, so
+                # it does not need to be cleared.
+                self._writes = 0
+                self._delete_expired()
+            if self.hot_size:
+                self._check_hot()
+                self._remember(key, value, expires)
+
+    def delete(self, key):
+        """Remove "key"; returns True if it was stored (even if expired)."""
+        with self._lock:
+            self._hot.pop(key, None)
+            return self._db.execute("DELETE FROM entries WHERE key = ?",
+                                    (key,)).rowcount > 0
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def purge(self):
+        """Delete expired entries; returns how many were deleted."""
+        with self._lock:
+            self._hot.clear()
+            return self._delete_expired()
+
+    def clear(self):
+        """Delete all entries."""
+        with self._lock:
+            self._hot.clear()
+            self._db.execute("DELETE FROM entries")
+
+    def close(self):
+        with self._lock:
+            self._hot.clear()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self.path)
+
+
+class BlobStore(object):
+    """A content-addressed store of files, named by the hash of their content.
+
+    Returned by `AppDirs.blob_store()`. Blobs are stored as
+    "<root>/ab/cd/abcd..." (the first two pairs of hex digits fan out
+    into 65536 subdirs), so no dir grows too large. Storing content that
+    is already present just returns its digest. Blobs must not be
+    modified in place.
+
+    `put_file()` avoids copying data where it can: a file on the same
+    filesystem as the store is hard-linked (or, with move=True, renamed)
+    into place, only being read once to hash it. Other content is
+    streamed in chunks into a temp file in the store, hashing it on the
+    way, and then renamed into place; readers never see partial blobs.
+    """
+
+    TMP_DIR = "tmp"
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root, algorithm="sha256"):
+        import hashlib
+        self.root = root
+        self.algorithm = algorithm
+        self._tmp_base = os.path.join(root, self.TMP_DIR, "blob")
+        self._new_hash = lambda: hashlib.new(algorithm)
+        self._digest_size = self._new_hash().digest_size
+
+    def path(self, digest):
+        """Return the path of the blob "digest", whether it exists or not."""
+        if len(digest) != self._digest_size * 2 or digest.strip(
+                "0123456789abcdef"):
+            raise ValueError("invalid %s digest: %r" % (self.algorithm, digest))
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        """Open the blob "digest" for reading (in binary mode)."""
+        return open(self.path(digest), "rb")
+
+    def put(self, data):
+        """Store the bytes "data"; returns its digest."""
+        digest = self._new_hash()
+        digest.update(data)
+        digest = digest.hexdigest()
+        if digest not in self:
+            self._add(_write_temp(self._tmp_base, data), digest)
+        return digest
+
+    def put_stream(self, fileobj, chunk_size=None):
+        """Store everything read from the binary file object "fileobj"."""
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        digest = self._new_hash()
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+        digest = digest.hexdigest()
+        self._add(tmp_path, digest)
+        return digest
+
+    def put_file(self, path, move=False):
+        """Store the file at "path"; returns its digest.
+
+        If "move" is true, the file is removed afterwards. On the store's
+        filesystem the file becomes the blob itself: renamed if "move" is
+        true, hard-linked otherwise (so it must not be modified later).
+        """
+        if os.stat(path).st_dev != os.stat(self.root).st_dev:
+            with open(path, "rb") as f:
+                digest = self.put_stream(f)
+            if move:
+                os.remove(path)
+            return digest
+        digest = self._new_hash()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        if digest in self:
+            if move:
+                os.remove(path)
+            return digest
+        tmp_path = self._tmp_path()
+        if move:
+            _replace(path, tmp_path)
+        else:
+            try:
+                os.link(path, tmp_path)
+            except (AttributeError, OSError):
+                # No hard links here (e.g. FAT, or Windows on Python 2).
+                with open(path, "rb") as f:
+                    return self.put_stream(f)
+        self._add(tmp_path, digest)
+        return digest
+
+    def delete(self, digest):
+        """Remove the blob "digest"; returns True if it existed."""
+        try:
+            os.remove(self.path(digest))
+        except OSError:
+            if digest in self:
+                raise
+            return False
+        return True
+
+    def __iter__(self):
+        """Yield the digests of all blobs, in no particular order."""
+        for first in _listdir_quietly(self.root):
+            if len(first) != 2 or first == self.TMP_DIR:
+                continue
+            for second in _listdir_quietly(os.path.join(self.root, first)):
+                for name in _listdir_quietly(
+                        os.path.join(self.root, first, second)):
+                    if name.startswith(first + second):
+                        yield name
+
+    def _tmp_path(self):
+        return "%s.%d.%d.tmp" % (self._tmp_base, os.getpid(), next(_temp_ids))
+
+    def _add(self, tmp_path, digest):
+        target = self.path(digest)
+        try:
+            _makedirs(os.path.dirname(target), 0o777, set())
+            _replace(tmp_path, target)
+        except BaseException:
+            _remove_quietly(tmp_path)
+            raise
+
+    def __repr__(self):
+        return "<%s %r %s>" % (type(self).__name__, self.root, self.algorithm)
+
+
+_QueueLogHandler = None
+
+
+def _queue_log_handler_class():
+    # Defined on first use: importing `logging` costs far more than
+    # importing appdirs itself.
+    global _QueueLogHandler
+    if _QueueLogHandler is not None:
+        return _QueueLogHandler
+
+    import io
+    import logging
+    import threading
+    from collections import deque
+
+    class QueueLogHandler(logging.Handler):
+        """Log handler that hands records to a single batching writer thread.
+
+        Producers only format the record and append it to a deque, taking
+        a lock only to wake an idle writer or while "max_queue" records
+        are already waiting. If the log file cannot be opened or written,
+        the batch is dropped, `handleError()` is called with its first
+        record and the file is opened again for the next batch.
+        """
+
+        def __init__(self, path, batch_size=256, max_queue=10000):
+            logging.Handler.__init__(self)
+            self.path = path
+            self.batch_size = batch_size
+            self.max_queue = max_queue
+            self._pending = deque()
+            lock = threading.Lock()
+            self._not_empty = threading.Condition(lock)
+            self._not_full = threading.Condition(lock)
+            self._idle = False  # the writer is (about to be) waiting
+            self._blocked = 0  # producers waiting for room in the queue
+            self._writer = threading.Thread(target=self._write_loop,
+                                            name="QueueLogHandler")
+            self._writer.daemon = True
+            self._writer.start()
+
+        def emit(self, record):
+            try:
+                line = self.format(record) + "\n"
+                if not isinstance(line, unicode):
+                    line = line.decode("utf-8", "replace")
+            except Exception:
+                self.handleError(record)
+                return
+            if not self._writer.is_alive():
+                # Closed: write directly rather than queue for nobody.
+                f = self._write(None, [line], record)
+                if f is not None:
+                    f.close()
+                return
+            if len(self._pending) >= self.max_queue:
+                with self._not_full:
+                    self._blocked += 1
+                    try:
+                        while (len(self._pending) >= self.max_queue and
+                               self._writer.is_alive()):
+                            self._not_full.wait(1)
+                    finally:
+                        self._blocked -= 1
+            self._put((line, record))
+
+        def _put(self, item):
+            # Append before reading `_idle`; the writer sets `_idle` before
+            # its last look at the deque, so one of us sees the other.
+            self._pending.append(item)
+            if self._idle:
+                with self._not_empty:
+                    self._not_empty.notify()
+
+        def _get(self, block=True):
+            pending = self._pending
+            while True:
+                try:
+                    return pending.popleft()
+                except IndexError:
+                    if not block:
+                        return ""
+                with self._not_empty:
+                    self._idle = True
+                    if not pending:
+                        self._not_empty.wait()
+                    self._idle = False
+
+        def flush(self):
+            """Wait until all records queued so far have been written."""
+            if self._writer.is_alive():
+                done = threading.Event()
+                self._put(done)
+                # Event.wait() only returns the flag from Python 2.7 on.
+                done.wait(1)
+                while not done.is_set() and self._writer.is_alive():
+                    done.wait(1)
+
+        def close(self):
+            """Write out all queued records and stop the writer thread."""
+            if self._writer.is_alive():
+                self._put(None)
+                self._writer.join()
+            logging.Handler.close(self)
+
+        def _write_loop(self):
+            f = None
+            closing = False
+            try:
+                while True:
+                    item = self._get(not closing)
+                    if item == "":
+                        return
+                    # Write up to one batch of lines, stopping early at a
+                    # close (None) or flush (Event) marker.
+                    lines = []
+                    first = None
+                    while item:
+                        if hasattr(item, "set"):
+                            break
+                        line, record = item
+                        lines.append(line)
+                        if first is None:
+                            first = record
+                        if len(lines) >= self.batch_size:
+                            item = ""
+                            break
+                        item = self._get(False)
+                    if item is None:
+                        closing = True
+                    if self._blocked:
+                        with self._not_full:
+                            self._not_full.notify_all()
+                    if lines:
+                        f = self._write(f, lines, first)
+                    if item:
+                        item.set()
+            finally:
+                if f is not None:
+                    f.close()
+
+        def _write(self, f, lines, record):
+            """Append "lines" to the log file; returns the open file or None."""
+            try:
+                if f is None:
+                    f = io.open(self.path, "a", encoding="utf-8")
+                f.write(u"".join(lines))
+                f.flush()
+                return f
+            except Exception:
+                self.handleError(record)
+                if f is not None:
+                    try:
+                        f.close()
+                    except Exception:
+                        pass
+                return None
+
+    _QueueLogHandler = QueueLogHandler
+    return QueueLogHandler
 
 
 #---- internal support stuff
 
+if hasattr(os, "replace"):
+    _replace = os.replace
+else:
+    def _replace(src, dst):
+        if system == "win32" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+_temp_ids = itertools.count()
+
+
+def _check_name(name):
+    """Return "name" if it is a plain file name in a dir, else raise."""
+    if not name or name in (".", "..") or os.sep in name or (
+            os.altsep and os.altsep in name):
+        raise ValueError("invalid file name: %r" % (name,))
+    return name
+
+
+def _write_temp(path, data, sync=False, keep_mode=False):
+    """Write "data" to a new temp file next to "path"; returns its path.
+
+    If "keep_mode" is true and "path" exists, the temp file gets its
+    permission bits (and, where allowed, its owner), so renaming it over
+    "path" does not widen access to, e.g., a private config file.
+    """
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), next(_temp_ids))
+    st = None
+    if keep_mode:
+        try:
+            st = os.stat(path)
+        except OSError:
+            pass
+    mode = st is not None and stat.S_IMODE(st.st_mode) or 0o666
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, "O_BINARY", 0), mode)
+    try:
+        if st is not None and hasattr(os, "fchmod"):
+            os.fchmod(fd, mode)  # not masked by the umask, unlike open()
+            if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+                try:
+                    os.fchown(fd, st.st_uid, st.st_gid)
+                except OSError:
+                    pass
+        while data:
+            data = data[os.write(fd, data):]
+        if sync:
+            getattr(os, "fdatasync", os.fsync)(fd)
+    except BaseException:
+        os.close(fd)
+        os.remove(tmp_path)
+        raise
+    os.close(fd)
+    return tmp_path
+
+
+def _rename_new(src, dst):
+    """Rename "src" to "dst" unless "dst" exists; returns True if renamed."""
+    try:
+        os.link(src, dst)
+    except AttributeError:
+        # No os.link (Windows on Python 2): os.rename does not overwrite.
+        try:
+            os.rename(src, dst)
+        except OSError:
+            if os.path.exists(dst):
+                return False
+            raise
+        return True
+    except OSError as ex:
+        if ex.errno == errno.EEXIST:
+            return False
+        raise
+    os.remove(src)
+    return True
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _listdir_quietly(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _fsync_path(path):
+    # fsync() flushes the file, not just what was written through this fd.
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        getattr(os, "fdatasync", os.fsync)(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    """Make renames in the dir "path" durable. A no-op on Windows."""
+    if system == "win32":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _iter_files(top, exclude=(), subdirs=None):
+    """Yield (relpath, lstat result) for each file under `top`.
+
+    The tree is streamed with `os.scandir` where available. Paths (relative
+    to `top`) in `exclude` are skipped; symlinks are not followed. If a
+    `subdirs` list is given, only `top` itself is listed and the names of
+    its subdirs are appended to that list.
+    """
+    stack = [""]
+    while stack:
+        reldir = stack.pop()
+        dirpath = os.path.join(top, reldir)
+        try:
+            if _scandir is not None:
+                entries = _scandir(dirpath)
+            else:
+                entries = os.listdir(dirpath)
+        except OSError:
+            continue
+        for entry in entries:
+            name = getattr(entry, "name", entry)
+            relpath = os.path.join(reldir, name)
+            if relpath in exclude:
+                continue
+            try:
+                if _scandir is not None:
+                    st = entry.stat(follow_symlinks=False)
+                else:
+                    st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if not stat.S_ISDIR(st.st_mode):
+                yield relpath, st
+            elif subdirs is not None:
+                subdirs.append(name)
+            else:
+                stack.append(relpath)
+
+
+def _has_high_char(path):
+    for c in path:
+        if ord(c) > 255:
+            return True
+    return False
+
+
+def _makedirs(path, mode, known):
+    """Like `os.makedirs(path, mode)`, but tolerant of existing dirs.
+
+    Paths in the `known` set are assumed to exist already; every dir
+    created or found along the way is added to it. Losing a creation race
+    to another process is not an error.
+    """
+    path = os.path.normpath(path)
+    missing = []
+    head = path
+    while head not in known and not os.path.isdir(head):
+        missing.append(head)
+        parent = os.path.dirname(head)
+        if parent == head:
+            break
+        head = parent
+    else:
+        known.add(head)
+    for name in reversed(missing):
+        try:
+            os.mkdir(name, mode)
+        except OSError:
+            if not os.path.isdir(name):
+                raise
+        known.add(name)
+
+
+def _dir_stat(path):
+    """Return the stat result of dir `path`, or None if it is not a dir."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+    return st
+
+
+def _dir_mtime(path):
+    """Return the mtime of dir `path`, or None if it is not a dir."""
+    st = _dir_stat(path)
+    if st is None:
+        return None
+    return getattr(st, "st_mtime_ns", st.st_mtime)
+
+
+def _list_dir(path, follow_symlinks=False):
+    """Return (files, subdirs) name lists for `path`.
+
+    Unless "follow_symlinks" is true, symlinks to dirs are left out of
+    both lists, so walks built on this do not follow them (like
+    `os.walk()`).
+    """
+    files, subdirs = [], []
+    if _scandir is not None:
+        for entry in _scandir(path):
+            if not entry.is_dir():
+                files.append(entry.name)
+            elif follow_symlinks or not entry.is_symlink():
+                subdirs.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            if not os.path.isdir(child):
+                files.append(name)
+            elif follow_symlinks or not os.path.islink(child):
+                subdirs.append(name)
+    return files, subdirs
+
+
+class _DirScanner(object):
+    """Caches dir listings, re-listing a dir only when its mtime changes."""
+    def __init__(self, follow_symlinks=False):
+        self.follow_symlinks = follow_symlinks
+        self._listings = {}
+
+    def scan(self, path):
+        """Return (mtime, files, subdirs, dir_id) for `path`, or None.
+
+        None is returned if `path` is not a dir. "files" is a frozenset of
+        names, "subdirs" a tuple of names and "dir_id" the (st_dev, st_ino)
+        pair identifying the dir.
+        """
+        st = _dir_stat(path)
+        if st is None:
+            self._listings.pop(path, None)
+            return None
+        mtime = getattr(st, "st_mtime_ns", st.st_mtime)
+        dir_id = (st.st_dev, st.st_ino)
+        listing = self._listings.get(path)
+        if (listing is not None and listing[0] == mtime and
+                listing[3] == dir_id):
+            return listing
+        try:
+            files, subdirs = _list_dir(path, self.follow_symlinks)
+        except OSError:
+            self._listings.pop(path, None)
+            return None
+        listing = self._listings[path] = (mtime, frozenset(files),
+                                          tuple(subdirs), dir_id)
+        return listing
+
+
+class _FileFinder(object):
+    """Finds files in an ordered list of dirs, caching hits and misses.
+
+    Every dir consulted for a cached result is re-stat'ed at most once per
+    `recheck` seconds; if any mtime changed, all results are dropped.
+    """
+    def __init__(self, search_dirs, recheck):
+        self.search_dirs = search_dirs
+        self.recheck = recheck
+        self._scanner = _DirScanner()
+        self._results = {}
+        self._watched = {}  # dir -> mtime (None if missing) when consulted
+        self._checked_at = time.time()
+
+    def find(self, name):
+        now = time.time()
+        if now - self._checked_at >= self.recheck:
+            self._checked_at = now
+            self._revalidate()
+        try:
+            return self._results[name]
+        except KeyError:
+            pass
+        head, tail = os.path.split(name)
+        found = None
+        for base in self.search_dirs:
+            dirpath = head and os.path.join(base, head) or base
+            listing = self._scanner.scan(dirpath)
+            self._watched[dirpath] = listing and listing[0]
+            if listing is not None and tail in listing[1]:
+                found = os.path.join(dirpath, tail)
+                break
+        self._results[name] = found
+        return found
+
+    def _revalidate(self):
+        for dirpath, mtime in list(self._watched.items()):
+            if _dir_mtime(dirpath) != mtime:
+                self._results.clear()
+                self._watched.clear()
+                return
+
+
+def _dir_usage(path, cache):
+    """Return (bytes, files) for the tree at `path`.
+
+    `cache` maps dir paths to (mtime, file names, subdir names); a dir
+    whose mtime is unchanged is not listed again, but its files are still
+    lstat'ed so that files growing in place are counted. Symlinks are
+    counted as files and not followed.
+    """
+    nbytes = nfiles = 0
+    stack = [path]
+    while stack:
+        dirpath = stack.pop()
+        mtime = _dir_mtime(dirpath)
+        if mtime is None:
+            cache.pop(dirpath, None)
+            continue
+        cached = cache.get(dirpath)
+        if cached is None or cached[0] != mtime:
+            files, subdirs = [], []
+            for name, st in _iter_files(dirpath, subdirs=subdirs):
+                files.append(name)
+                nbytes += st.st_size
+                nfiles += 1
+            cached = cache[dirpath] = (mtime, tuple(files), tuple(subdirs))
+        else:
+            for name in cached[1]:
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                nbytes += st.st_size
+                nfiles += 1
+        stack.extend(os.path.join(dirpath, name) for name in cached[2])
+    return nbytes, nfiles
+
+
+_LAYOUT_MAGIC = "appdirs-layout-1"
+
+
+def _portable_fingerprint():
+    """Like `_env_fingerprint()`, but comparable across processes."""
+    fingerprint = _env_fingerprint()
+    return fingerprint[:1] + fingerprint[2:]
+
+
+def _env_get(env, name, default=None):
+    """`os.getenv()`, or a lookup in "env" if that is given."""
+    if env is None:
+        return _getenv(name, default)
+    return env.get(name, default)
+
+
+def _expanduser(path, env=None, home=None):
+    """Like `os.path.expanduser()`, but with "~" meaning "home" if given.
+
+    "home" defaults to env["HOME"], if "env" is given and has it.
+    """
+    if home is None and env is not None:
+        home = env.get("HOME")
+    if home is None or not (path == "~" or path.startswith("~/") or
+                            path.startswith("~" + os.sep)):
+        return os.path.expanduser(path)
+    return home.rstrip(os.sep) + path[1:] or os.sep
+
+
+def _env_items(env):
+    """Return the relevant part of the mapping "env" as a hashable tuple."""
+    if env is None:
+        return None
+    return tuple((name, env[name]) for name in _ENV_VARS if name in env)
+
+
+def _runtime_fallback(env=None):
+    """The runtime dir to use on Unix if $XDG_RUNTIME_DIR is not set."""
+    return os.path.join(_env_get(env, "TMPDIR") or "/tmp",
+                        "runtime-%d" % os.getuid())
+
+
+def _secure_runtime_fallback(path, env, known):
+    """Safely create the fallback runtime dir, if "path" is inside it.
+
+    Anyone can create dirs in /tmp, so the dir must be private to, and
+    owned by, the current user; an existing one that is not is refused.
+    The dir is added to the `known` set of `_makedirs()`.
+    """
+    if system in ("win32", "darwin") or _env_get(env, "XDG_RUNTIME_DIR"):
+        return
+    base = _runtime_fallback(env)
+    if path != base and not path.startswith(base + os.sep):
+        return
+    try:
+        os.mkdir(base, 0o700)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    st = os.lstat(base)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise OSError(errno.EPERM, "runtime dir is not a dir owned by the "
+                      "current user", base)
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        os.chmod(base, 0o700)
+    known.add(base)
+
+
+def _home_join(home, path):
+    """Equivalent to `os.path.expanduser("~/" + path)` for a known `home`."""
+    return home.rstrip(os.sep) + os.sep + path
+
+
+def _subdir(base, suffix):
+    """Equivalent to `os.path.join(base, suffix)` for a relative `suffix`."""
+    if not suffix:
+        return base
+    if not base or base.endswith(os.sep):
+        return base + suffix
+    return base + os.sep + suffix
+
+
+def _environ_snapshot():
+    """Return a dict of the variables in `_ENV_VARS` that are set."""
+    get = os.environ.get
+    env = {}
+    for name in _ENV_VARS:
+        value = get(name)
+        if value is not None:
+            env[name] = value
+    return env
+
+
+def _platform_roots(env=None, home=None, split_dirs=None):
+    """Return the platform base dirs that every app dir is derived from.
+
+    Each environment variable is read, and "~" expanded, at most once.
+    "env" and "home" are as for `user_data_dir()`; they are not used on
+    Windows. "split_dirs" is an optional dict memoizing `_split_dirs()`
+    across calls.
+    """
+    if system == "win32":
+        return {
+            "system": system,
+            "local": os.path.normpath(_get_win_folder("CSIDL_LOCAL_APPDATA")),
+            "roaming": os.path.normpath(_get_win_folder("CSIDL_APPDATA")),
+            "common": os.path.normpath(_get_win_folder("CSIDL_COMMON_APPDATA")),
+        }
+    if env is None:
+        env = _environ_snapshot()
+    if home is None:
+        home = env.get("HOME")
+        if home is None:
+            home = os.path.expanduser("~")
+    if system == "darwin":
+        return {
+            "system": system,
+            "data": _home_join(home, "Library/Application Support/"),
+            "cache": _home_join(home, "Library/Caches"),
+            "log": _home_join(home, "Library/Logs"),
+            "runtime": _home_join(home, "Library/Caches/TemporaryItems"),
+            "site": "/Library/Application Support",
+        }
+    data_dirs = env.get("XDG_DATA_DIRS",
+                        os.pathsep.join(["/usr/local/share", "/usr/share"]))
+    config_dirs = env.get("XDG_CONFIG_DIRS", "/etc/xdg")
+    return {
+        "system": system,
+        "data": env.get("XDG_DATA_HOME", _home_join(home, ".local/share")),
+        "config": env.get("XDG_CONFIG_HOME", _home_join(home, ".config")),
+        "cache": env.get("XDG_CACHE_HOME", _home_join(home, ".cache")),
+        "state": env.get("XDG_STATE_HOME", _home_join(home, ".local/state")),
+        "runtime": env.get("XDG_RUNTIME_DIR") or _runtime_fallback(env),
+        "data_dirs": _split_dirs(data_dirs, home, split_dirs),
+        "config_dirs": _split_dirs(config_dirs, home, split_dirs),
+    }
+
+
+def _split_dirs(value, home=None, memo=None):
+    """Split an XDG_*_DIRS value as `site_data_dir()` does."""
+    if memo is not None:
+        key = "~" in value and (value, home) or value
+        try:
+            return memo[key]
+        except KeyError:
+            result = memo[key] = _split_dirs(value, home)
+            return result
+    return [x.startswith("~") and _expanduser(x.rstrip(os.sep), None, home)
+            or x.rstrip(os.sep) for x in value.split(os.pathsep)]
+
+
+def _app_layout(roots, appname=None, appauthor=None, version=None,
+                roaming=False, multipath=False):
+    """Build an `AppDirsLayout` from `_platform_roots()` output.
+
+    The result matches what the `AppDirs` properties return for the same
+    arguments.
+    """
+    join = os.path.join
+    ver = appname and version or None
+    if roots["system"] == "win32":
+        app = None
+        if appname:
+            if appauthor is None:
+                appauthor = appname
+            app = appauthor is not False and join(appauthor, appname) or appname
+        app_ver = app and ver and join(app, ver) or app
+        user_data = _subdir(roots[roaming and "roaming" or "local"], app_ver)
+        local = _subdir(roots["local"], app_ver)
+        cache = runtime = local
+        if app:
+            ver_parts = ver and (ver,) or ()
+            cache = _subdir(roots["local"], join(app, "Cache", *ver_parts))
+            runtime = _subdir(roots["local"], join(app, "Temp", *ver_parts))
+        site = _subdir(roots["common"], app_ver)
+        return AppDirsLayout(user_data, user_data, cache, local,
+                             join(local, "Logs"), site, site, runtime)
+    suffix = ver and join(appname, ver) or appname
+    if roots["system"] == "darwin":
+        user_data = _subdir(roots["data"], suffix)
+        site = _subdir(roots["site"], suffix)
+        return AppDirsLayout(user_data, user_data,
+                             _subdir(roots["cache"], suffix), user_data,
+                             _subdir(roots["log"], suffix), site, site,
+                             _subdir(roots["runtime"], suffix))
+    cache = _subdir(roots["cache"], suffix)
+    site_paths = []
+    for dirs in (roots["data_dirs"], roots["config_dirs"]):
+        if suffix:
+            dirs = [x + os.sep + suffix for x in dirs]
+        site_paths.append(multipath and os.pathsep.join(dirs) or dirs[0])
+    return AppDirsLayout(_subdir(roots["data"], suffix),
+                         _subdir(roots["config"], suffix),
+                         cache,
+                         _subdir(roots["state"], suffix),
+                         _subdir(cache, "log"),
+                         site_paths[0], site_paths[1],
+                         _subdir(roots["runtime"], suffix))
+
+
 def _get_win_folder_from_registry(csidl_name):
     """This is a fallback technique at best. I'm not sure if using the
     registry for this guarantees us the correct answer for all CSIDL_*
@@ -487,12 +2829,7 @@ def _get_win_folder_with_pywin32(csidl_name):
 
         # Downgrade to short path name if have highbit chars. See
         # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
-        has_high_char = False
-        for c in dir:
-            if ord(c) > 255:
-                has_high_char = True
-                break
-        if has_high_char:
+        if _has_high_char(dir):
             try:
                 import win32api
                 dir = win32api.GetShortPathName(dir)
@@ -517,12 +2854,7 @@ def _get_win_folder_with_ctypes(csidl_name):
 
     # Downgrade to short path name if have highbit chars. See
     # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
-    has_high_char = False
-    for c in buf:
-        if ord(c) > 255:
-            has_high_char = True
-            break
-    if has_high_char:
+    if _has_high_char(buf.value):
         buf2 = ctypes.create_unicode_buffer(1024)
         if ctypes.windll.kernel32.GetShortPathNameW(buf.value, buf2, 1024):
             buf = buf2
@@ -542,12 +2874,7 @@ def _get_win_folder_with_jna(csidl_name):
 
     # Downgrade to short path name if have highbit chars. See
     # <http://bugs.activestate.com/show_bug.cgi?id=85099>.
-    has_high_char = False
-    for c in dir:
-        if ord(c) > 255:
-            has_high_char = True
-            break
-    if has_high_char:
+    if _has_high_char(dir):
         buf = array.zeros('c', buf_size)
         kernel = win32.Kernel32.INSTANCE
         if kernel.GetShortPathName(dir, buf, buf_size):
@@ -555,54 +2882,370 @@ def _get_win_folder_with_jna(csidl_name):
 
     return dir
 
-if system == "win32":
-    try:
-        import win32com.shell
-        _get_win_folder = _get_win_folder_with_pywin32
-    except ImportError:
-        try:
-            from ctypes import windll
-            _get_win_folder = _get_win_folder_with_ctypes
-        except ImportError:
+def _probe_pywin32():
+    import win32com.shell
+
+
+def _probe_ctypes():
+    from ctypes import windll
+
+
+def _probe_jna():
+    import com.sun.jna
+
+
+# Windows known-folder backends in order of preference, as
+# (name, probe, getter) tuples. `probe` raises ImportError when the backend
+# is unavailable; a None probe means it is always usable. Probing is
+# deferred until the first `_get_win_folder()` call so that importing
+# appdirs stays cheap.
+_folder_backends = [
+    ("pywin32", _probe_pywin32, _get_win_folder_with_pywin32),
+    ("ctypes", _probe_ctypes, _get_win_folder_with_ctypes),
+    ("jna", _probe_jna, _get_win_folder_with_jna),
+    ("registry", None, _get_win_folder_from_registry),
+]
+_folder_backend = None  # selected (name, getter), or None until probed
+
+# Known-folder lookups are cached for the life of the process (they
+# rarely change and every backend is comparatively slow), so the
+# short-path downgrade also only runs once per folder.
+# `refresh_folder_cache()` empties the cache.
+_WIN_FOLDER_CACHE_SIZE = 16
+_win_folder_cache = {}
+_folder_generation = 0  # bumped on refresh so `AppDirs` caches drop too
+
+
+def register_folder_backend(name, getter, probe=None):
+    """Register a Windows known-folder backend, preferred over the builtins.
+
+        "name" identifies the backend, e.g. for `set_folder_backend()`.
+        "getter" is called with a CSIDL name such as "CSIDL_APPDATA" and
+            must return the folder path.
+        "probe" is an optional callable that raises ImportError if the
+            backend cannot be used in this process.
+    """
+    global _folder_backend
+    _folder_backends[:] = [b for b in _folder_backends if b[0] != name]
+    _folder_backends.insert(0, (name, probe, getter))
+    _folder_backend = None
+    refresh_folder_cache()
+
+
+def set_folder_backend(backend):
+    """Select the Windows known-folder backend explicitly.
+
+    "backend" is the name of a registered backend, a getter callable (see
+    `register_folder_backend()`), or None to go back to probing the
+    registered backends on the next lookup.
+    """
+    global _folder_backend
+    if backend is None:
+        selected = None
+    elif callable(backend):
+        selected = (getattr(backend, "__name__", "custom"), backend)
+    else:
+        for name, probe, getter in _folder_backends:
+            if name == backend:
+                selected = (name, getter)
+                break
+        else:
+            raise ValueError("unknown folder backend: %r" % (backend,))
+    _folder_backend = selected
+    refresh_folder_cache()
+    if _instrumentation is not None and selected is not None:
+        _instrumentation.record("backend", selected[0], "explicit")
+
+
+def refresh_folder_cache():
+    """Forget cached Windows known-folder paths, e.g. after one was moved."""
+    global _folder_generation
+    _win_folder_cache.clear()
+    _folder_generation += 1
+
+
+def get_folder_backend():
+    """Return the name of the Windows known-folder backend, probing if needed."""
+    return (_folder_backend or _select_folder_backend())[0]
+
+
+def _select_folder_backend():
+    global _folder_backend
+    for name, probe, getter in _folder_backends:
+        if probe is not None:
             try:
-                import com.sun.jna
-                _get_win_folder = _get_win_folder_with_jna
+                probe()
             except ImportError:
-                _get_win_folder = _get_win_folder_from_registry
+                continue
+        _folder_backend = (name, getter)
+        if _instrumentation is not None:
+            _instrumentation.record("backend", name, "probed")
+        return _folder_backend
+    raise RuntimeError("no Windows folder backend is available")
+
+
+def _get_win_folder(csidl_name):
+    try:
+        return _win_folder_cache[csidl_name]
+    except KeyError:
+        pass
+    backend = _folder_backend or _select_folder_backend()
+    path = backend[1](csidl_name)
+    if len(_win_folder_cache) >= _WIN_FOLDER_CACHE_SIZE:
+        _win_folder_cache.clear()
+    _win_folder_cache[csidl_name] = path
+    return path
+
+
+#---- instrumentation
+
+# Functions wrapped by `enable_instrumentation()`.
+_INSTRUMENTED = (
+    "user_data_dir",
+    "site_data_dir",
+    "user_config_dir",
+    "site_config_dir",
+    "user_cache_dir",
+    "user_state_dir",
+    "user_log_dir",
+    "user_runtime_dir",
+    "resolve_many",
+    "resolve_users",
+    "_platform_roots",
+    "_get_win_folder",
+)
+_instrumentation = None  # an `_Instrumentation` while enabled
+
+
+class _Instrumentation(object):
+    def __init__(self, callback):
+        import threading
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.seconds = {}
+        self.env_reads = {}
+        self.backends = []
+        self.originals = {}
+
+    def record(self, event, name, value):
+        with self.lock:
+            if event == "call":
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.seconds[name] = self.seconds.get(name, 0.0) + value
+            elif event == "env":
+                self.env_reads[name] = self.env_reads.get(name, 0) + 1
+            elif event == "backend":
+                self.backends.append((name, value))
+        if self.callback is not None:
+            self.callback(event, name, value)
+
+
+def enable_instrumentation(callback=None):
+    r"""Start counting and timing dir resolution in this process.
+
+        "callback" is an optional callable, called as
+            callback(event, name, value) for every event:
+            - ("call", <function name>, <elapsed seconds>) after each call
+              of a public function (and of some internal ones, such as
+              "_get_win_folder");
+            - ("env", <variable name>, None) for each environment variable
+              read;
+            - ("backend", <backend name>, "probed" or "explicit") when a
+              Windows known-folder backend is selected.
+
+    Totals are available from `instrumentation_stats()`. Enabling again
+    resets them. Instrumentation works by swapping in wrapped functions, so
+    while it is disabled (the default) it costs nothing.
+    """
+    import functools
+    global _instrumentation
+    disable_instrumentation()
+    inst = _Instrumentation(callback)
+    timer = getattr(time, "perf_counter", time.time)
+    namespace = globals()
+
+    def timed(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                inst.record("call", name, timer() - start)
+        return wrapper
+
+    def getenv(name, default=None):
+        inst.record("env", name, None)
+        return inst.originals["_getenv"](name, default)
+
+    def environ_snapshot():
+        for name in _ENV_VARS:
+            inst.record("env", name, None)
+        return inst.originals["_environ_snapshot"]()
+
+    for name in _INSTRUMENTED:
+        inst.originals[name] = namespace[name]
+        namespace[name] = timed(name, namespace[name])
+    inst.originals["_getenv"] = _getenv
+    inst.originals["_environ_snapshot"] = _environ_snapshot
+    namespace["_getenv"] = getenv
+    namespace["_environ_snapshot"] = environ_snapshot
+    _instrumentation = inst
+
+
+def disable_instrumentation():
+    """Stop instrumentation and restore the original functions."""
+    global _instrumentation
+    if _instrumentation is None:
+        return
+    globals().update(_instrumentation.originals)
+    _instrumentation = None
+
+
+def instrumentation_stats():
+    """Return a snapshot of the instrumentation totals, or None if disabled.
+
+    The snapshot is a dict with these keys:
+        "calls":     {function name: number of calls}
+        "seconds":   {function name: cumulative seconds spent}
+        "env_reads": {variable name: number of reads}
+        "backends":  [(backend name, "probed" or "explicit"), ...]
+    """
+    inst = _instrumentation
+    if inst is None:
+        return None
+    with inst.lock:
+        return {
+            "calls": dict(inst.calls),
+            "seconds": dict(inst.seconds),
+            "env_reads": dict(inst.env_reads),
+            "backends": list(inst.backends),
+        }
 
 
 #---- self test code
 
-if __name__ == "__main__":
+def _shell_quote(value):
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def _shell_name(appname, kind):
+    """Return the shell variable name for "kind" of "appname".
+
+    Anything but ASCII letters and digits in the app name becomes "_".
+    """
+    name = "".join(c.upper() if ord(c) < 128 and c.isalnum() else "_"
+                   for c in appname)
+    if name[:1].isdigit():
+        name = "_" + name
+    return "%s_%s" % (name, kind.upper())
+
+
+def _parse_app_spec(spec):
+    """Split "NAME[:AUTHOR[:VERSION]]" into `AppDirs` arguments."""
+    parts = spec.split(":", 2)
+    if not parts[0]:
+        raise ValueError("missing app name in %r" % spec)
+    parts += [None] * (3 - len(parts))
+    return tuple([part or None for part in parts])
+
+
+def _demo():
     appname = "MyApp"
     appauthor = "MyCompany"
 
-    props = ("user_data_dir",
-             "user_config_dir",
-             "user_cache_dir",
-             "user_state_dir",
-             "user_log_dir",
-             "site_data_dir",
-             "site_config_dir")
-
     print("-- app dirs %s --" % __version__)
 
     print("-- app dirs (with optional 'version')")
     dirs = AppDirs(appname, appauthor, version="1.0")
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    for prop, path in zip(_KINDS, dirs.resolve_all()):
+        print("%s: %s" % (prop, path))
 
     print("\n-- app dirs (without optional 'version')")
     dirs = AppDirs(appname, appauthor)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    for prop, path in zip(_KINDS, dirs.resolve_all()):
+        print("%s: %s" % (prop, path))
 
     print("\n-- app dirs (without optional 'appauthor')")
     dirs = AppDirs(appname)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    for prop, path in zip(_KINDS, dirs.resolve_all()):
+        print("%s: %s" % (prop, path))
 
     print("\n-- app dirs (with disabled 'appauthor')")
     dirs = AppDirs(appname, appauthor=False)
-    for prop in props:
-        print("%s: %s" % (prop, getattr(dirs, prop)))
+    for prop, path in zip(_KINDS, dirs.resolve_all()):
+        print("%s: %s" % (prop, path))
+
+
+def main(argv=None):
+    """Command line interface: ``python -m appdirs [options] APP...``.
+
+    Resolves the requested dir kinds for every APP spec
+    ("NAME[:AUTHOR[:VERSION]]") in one go and writes them to stdout as
+    plain lines (one path per line), JSON, shell ``export`` statements or
+    NUL-terminated paths. Without arguments prints a demo for "MyApp".
+    Returns the exit status.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        _demo()
+        return 0
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m appdirs",
+        description="Print application dirs for one or more apps.")
+    parser.add_argument("apps", nargs="+", metavar="APP",
+                        help="app spec: NAME[:AUTHOR[:VERSION]]")
+    parser.add_argument("-k", "--kind", action="append", dest="kinds",
+                        choices=_KINDS, metavar="KIND",
+                        help="dir kind to print, e.g. user_cache_dir; may be "
+                             "repeated (default: all kinds)")
+    parser.add_argument("-f", "--format", default="text",
+                        choices=("text", "json", "shell", "nul"),
+                        help="output format (default: %(default)s)")
+    parser.add_argument("--roaming", action="store_true",
+                        help="use the roaming user data/config dir (Windows)")
+    parser.add_argument("--multipath", action="store_true",
+                        help="list all site dirs, separated by os.pathsep")
+    args = parser.parse_args(argv)
+
+    try:
+        specs = [_parse_app_spec(spec) for spec in args.apps]
+    except ValueError as ex:
+        parser.error(str(ex))
+    if args.format == "shell":
+        seen = {}
+        for spec, (appname, _, _) in zip(args.apps, specs):
+            prefix = _shell_name(appname, "")
+            if seen.setdefault(prefix, spec) != spec:
+                parser.error("APP %r and %r would both set %s* variables"
+                             % (seen[prefix], spec, prefix))
+    kinds = args.kinds or list(_KINDS)
+    layouts = resolve_many(
+        [spec + (args.roaming, args.multipath) for spec in specs], kinds)
+
+    out = sys.stdout
+    if args.format == "json":
+        import json
+        json.dump(dict((spec, dict(zip(kinds, layout)))
+                       for spec, layout in zip(args.apps, layouts)),
+                  out, indent=2, sort_keys=True)
+        out.write("\n")
+    elif args.format == "shell":
+        for (appname, _, _), layout in zip(specs, layouts):
+            for kind, path in zip(kinds, layout):
+                out.write("export %s=%s\n" % (_shell_name(appname, kind),
+                                               _shell_quote(path)))
+    else:
+        end = args.format == "nul" and "\0" or "\n"
+        for layout in layouts:
+            for path in layout:
+                out.write(path + end)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
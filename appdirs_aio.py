@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""asyncio helpers for appdirs.
+
+Each coroutine takes an `appdirs.AppDirs` instance and runs any blocking
+work (environment and home dir lookups, Windows known-folder calls,
+filesystem syscalls) in a bounded thread pool, so the event loop is never
+blocked. Requires Python 3.5+.
+
+    >>> import asyncio, appdirs, appdirs_aio
+    >>> dirs = appdirs.AppDirs("SuperApp", "Acme")
+    >>> asyncio.run(appdirs_aio.ensure(dirs))
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import appdirs
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+
+
+def set_executor(executor):
+    """Use `executor` for all blocking calls.
+
+    Pass None to go back to the default pool of `DEFAULT_MAX_WORKERS`
+    threads, created on first use.
+    """
+    global _executor
+    _executor = executor
+
+
+def get_executor():
+    """Return the executor used for blocking calls, creating it if needed."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+    return _executor
+
+
+def _run(func, *args):
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(get_executor(), functools.partial(func, *args))
+
+
+async def resolve_all(dirs):
+    """Return `dirs.resolve_all()` without blocking the event loop."""
+    layout = dirs._current_cache().get("layout")
+    if layout is not None:
+        return layout
+    return await _run(dirs.resolve_all)
+
+
+async def resolve(dirs, kind):
+    """Return the path of the given kind of dir, e.g. "user_cache_dir"."""
+    if kind not in appdirs._KINDS:
+        raise ValueError("unknown dir kind: %s" % kind)
+    return getattr(await resolve_all(dirs), kind)
+
+
+async def ensure(dirs, kinds=None, mode=0o777):
+    """Awaitable `AppDirs.ensure()`."""
+    return await _run(dirs.ensure, kinds, mode)
+
+
+async def exists(dirs, kind):
+    """Return True if the given kind of dir exists and is a directory."""
+    return await _run(os.path.isdir, await resolve(dirs, kind))
+
+
+async def listdir(dirs, kind):
+    """Return the sorted entry names of the given kind of dir."""
+    names = await _run(os.listdir, await resolve(dirs, kind))
+    return sorted(names)
@@ -9,9 +9,10 @@ except ImportError:
     from distutils.core import setup
 import ast
 
-tests_require = []
-if sys.version_info < (2, 7):
-    tests_require.append("unittest2")
+# appdirs_aio uses async/await, which older Pythons cannot even compile.
+py_modules = ["appdirs"]
+if sys.version_info >= (3, 5):
+    py_modules.append("appdirs_aio")
 
 
 def read(fname):
@@ -40,7 +41,6 @@ setup(
         License :: OSI Approved :: MIT License
         Operating System :: OS Independent
         Programming Language :: Python :: 2
-        Programming Language :: Python :: 2.6
         Programming Language :: Python :: 2.7
         Programming Language :: Python :: 3
         Programming Language :: Python :: 3.2
@@ -53,7 +53,7 @@ setup(
         Topic :: Software Development :: Libraries :: Python Modules
         """.split('\n') if c.strip()],
     test_suite='test.test_api',
-    tests_require=tests_require,
+    python_requires=">=2.7, !=3.0.*, !=3.1.*",
     keywords='application directory log cache user',
     author='Trent Mick',
     author_email='trentm@gmail.com',
@@ -61,5 +61,5 @@ setup(
     maintainer_email='trentm@gmail.com; github@srid.name; jr@its.to',
     url='http://github.com/ActiveState/appdirs',
     license='MIT',
-    py_modules=["appdirs"],
+    py_modules=py_modules,
 )
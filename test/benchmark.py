@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+"""Benchmark suite for appdirs.
+
+Usage:
+    python test/benchmark.py [--only SUBSTRING] [--quick]
+                             [--json OUTPUT] [--baseline BASELINE.json]
+                             [--threshold 0.25]
+
+Most benchmarks report the best time per call in microseconds; memory
+benchmarks report bytes or allocated blocks per instance. With
+--json the results are also written as JSON; with --baseline they are
+compared against an earlier --json file and the run fails (exit status 1)
+if any benchmark got slower by more than --threshold (a fraction).
+
+Path resolution is measured with `appdirs.system` forced to each of
+linux, darwin and win32 (using a fake Windows folder backend) and with
+several environment variants.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import appdirs
+
+SYSTEMS = ("linux2", "darwin", "win32")
+
+# Environment variants for path resolution.
+ENVIRONMENTS = {
+    "default": {},
+    "xdg": {
+        "XDG_DATA_HOME": "/xdg/data",
+        "XDG_CONFIG_HOME": "/xdg/config",
+        "XDG_CACHE_HOME": "/xdg/cache",
+        "XDG_STATE_HOME": "/xdg/state",
+        "XDG_DATA_DIRS": "/xdg/site-data:/usr/share",
+        "XDG_CONFIG_DIRS": "/xdg/site-config:/etc/xdg",
+    },
+    "long-dirs": {
+        "XDG_DATA_DIRS": os.pathsep.join("/opt/d%d/share" % i for i in range(20)),
+        "XDG_CONFIG_DIRS": os.pathsep.join("/opt/d%d/etc" % i for i in range(20)),
+    },
+}
+
+FUNCTIONS = (
+    ("user_data_dir", {}),
+    ("user_runtime_dir", {}),
+    ("user_config_dir", {}),
+    ("user_cache_dir", {}),
+    ("user_state_dir", {}),
+    ("user_log_dir", {}),
+    ("site_data_dir", {}),
+    ("site_config_dir", {}),
+    ("site_data_dir", {"multipath": True}),
+    ("site_config_dir", {"multipath": True}),
+)
+
+# Set by --quick; scales the number of iterations down.
+SCALE = 1.0
+
+
+def bench(func, number):
+    """Return the best per-call time of `func`, in microseconds."""
+    number = max(1, int(number * SCALE))
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+class forced(object):
+    """Context manager forcing `appdirs.system` and an environment variant."""
+    def __init__(self, system, env_name):
+        self.system = system
+        self.env = ENVIRONMENTS[env_name]
+
+    def __enter__(self):
+        self.saved = appdirs.system, os.environ.copy()
+        appdirs.system = self.system
+        for name in appdirs._ENV_VARS:
+            if name.startswith("XDG_"):
+                os.environ.pop(name, None)
+        os.environ.update(self.env)
+        if self.system == "win32":
+            appdirs.set_folder_backend(fake_win_folder)
+
+    def __exit__(self, *exc_info):
+        appdirs.system = self.saved[0]
+        os.environ.clear()
+        os.environ.update(self.saved[1])
+        appdirs.set_folder_backend(None)
+
+
+def bench_resolution():
+    """Free functions and AppDirs property access per system/environment."""
+    results = []
+    for system in SYSTEMS:
+        for env_name in sorted(ENVIRONMENTS):
+            if system != "linux2" and env_name != "default":
+                continue  # XDG variables only matter on Unix
+            tag = "%s/%s" % (system, env_name)
+            with forced(system, env_name):
+                for name, kwargs in FUNCTIONS:
+                    func = getattr(appdirs, name)
+                    label = name + (kwargs and "(multipath)" or "")
+                    results.append((
+                        "%s %s" % (label, tag),
+                        bench(lambda: func("MyApp", "MyCompany", "1.0", **kwargs),
+                              10000)))
+                dirs = appdirs.AppDirs("MyApp", "MyCompany", "1.0")
+                results.append(("AppDirs.user_data_dir (cached) %s" % tag,
+                                bench(lambda: dirs.user_data_dir, 10000)))
+                results.append(("AppDirs.user_data_dir (fresh) %s" % tag,
+                                bench(lambda: appdirs.AppDirs(
+                                    "MyApp", "MyCompany", "1.0").user_data_dir,
+                                      10000)))
+                results.append(("AppDirs.resolve_all (fresh) %s" % tag,
+                                bench(lambda: appdirs.AppDirs(
+                                    "MyApp", "MyCompany", "1.0").resolve_all(),
+                                      5000)))
+    return results
+
+
+def bench_import():
+    """Cold `import appdirs` in a fresh interpreter, net of startup."""
+    # Measure with bytecode cached, as in a real install.
+    env = os.environ.copy()
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    def run(code):
+        times = []
+        for _ in range(max(3, int(10 * SCALE))):
+            start = time.time()
+            subprocess.check_call([sys.executable, "-S", "-c", code],
+                                  cwd=ROOT, env=env)
+            times.append(time.time() - start)
+        return min(times)
+    run("import appdirs")  # write the bytecode cache
+    baseline = run("pass")
+    return [("import appdirs (cold)",
+             max(0.0, run("import appdirs") - baseline) * 1e6)]
+
+
+def fake_win_folder(csidl_name):
+    return {
+        "CSIDL_APPDATA": "C:\\Users\\me\\AppData\\Roaming",
+        "CSIDL_COMMON_APPDATA": "C:\\ProgramData",
+        "CSIDL_LOCAL_APPDATA": "C:\\Users\\me\\AppData\\Local",
+    }[csidl_name]
+
+
+def bench_resolve_many(napps=500):
+    apps = [("Plugin%d" % i, "MyCompany", "1.0") for i in range(napps)]
+
+    def per_call_loop():
+        for app in apps:
+            dirs = appdirs.AppDirs(*app)
+            dirs.user_data_dir
+            dirs.site_data_dir
+
+    def batched():
+        appdirs.resolve_many(apps, kinds=("user_data_dir", "site_data_dir"))
+
+    return [
+        ("per-call loop (%d apps)" % napps, bench(per_call_loop, 10)),
+        ("resolve_many (%d apps)" % napps, bench(batched, 10)),
+    ]
+
+
+def bench_folder_backend():
+    saved_system, saved_backends = appdirs.system, list(appdirs._folder_backends)
+    appdirs.system = "win32"
+    appdirs.register_folder_backend("fake", fake_win_folder)
+    try:
+        def select():
+            appdirs.set_folder_backend(None)
+            appdirs.get_folder_backend()
+
+        def lookup():
+            appdirs.user_data_dir("MyApp", "MyCompany")
+
+        return [
+            ("backend selection (win32, fake)", bench(select, 1000)),
+            ("user_data_dir (win32, fake)", bench(lookup, 10000)),
+        ]
+    finally:
+        appdirs.system = saved_system
+        appdirs._folder_backends[:] = saved_backends
+        appdirs.set_folder_backend(None)
+
+
+def bench_aio_loop_lag(counts=(10, 100, 500), mkdir_delays=(0, 0.001)):
+    """Worst event-loop lag while many coroutines set up their dirs.
+
+    A non-zero mkdir delay simulates a slow (e.g. network) filesystem.
+
+    On a local filesystem (no mkdir delay) aio.ensure does not reduce the
+    lag: like the blocking path it grows from about 1ms for 10 coroutines
+    to 30-40ms for 500, as the loop thread is busy resolving the paths and
+    handing the calls to the thread pool. It only helps when the
+    filesystem is slow: with a 1ms mkdir delay and 500 coroutines the lag
+    is about 16ms, against about 600ms for the blocking path.
+    """
+    try:
+        import asyncio
+        import appdirs_aio
+    except (ImportError, SyntaxError):
+        return []
+
+    def blocking_ensure(dirs, kinds):
+        # A coroutine that does the filesystem work on the loop thread.
+        future = loop.create_future()
+        future.set_result(dirs.ensure(kinds))
+        return future
+
+    def tick(expected):
+        now = loop.time()
+        lags.append(now - expected)
+        if running:
+            loop.call_later(0.001, tick, now + 0.001)
+
+    results = []
+    saved_environ, saved_mkdir = os.environ.copy(), os.mkdir
+    tmpdir = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        for delay in mkdir_delays:
+            def mkdir(path, mode=0o777):
+                time.sleep(delay)
+                saved_mkdir(path, mode)
+            os.mkdir = delay and mkdir or saved_mkdir
+            for count in counts:
+                for label, ensure in (("aio.ensure", appdirs_aio.ensure),
+                                      ("blocking ensure", blocking_ensure)):
+                    os.environ["XDG_DATA_HOME"] = os.path.join(
+                        tmpdir, "%s-%s-%d" % (label, delay, count))
+                    lags = []
+                    running = True
+                    loop.call_soon(tick, loop.time())
+                    coros = [ensure(appdirs.AppDirs("App%d" % i),
+                                    ["user_data_dir"])
+                             for i in range(count)]
+                    loop.run_until_complete(asyncio.gather(*coros))
+                    running = False
+                    results.append((
+                        "%s loop lag (%d coros, %gms mkdir)"
+                        % (label, count, delay * 1000),
+                        max(lags) * 1e6))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+        os.mkdir = saved_mkdir
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+    return results
+
+
+def bench_log_handler(threads=(1, 8, 32), records=20000):
+    """Per-record cost with many producer threads, vs. logging.FileHandler."""
+    import logging
+    import threading
+
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp()
+    os.environ["XDG_CACHE_HOME"] = tmpdir
+    results = []
+    try:
+        dirs = appdirs.AppDirs("BenchApp")
+        for nthreads in threads:
+            for label in ("QueueLogHandler", "FileHandler"):
+                if label == "FileHandler":
+                    handler = logging.FileHandler(
+                        os.path.join(dirs.ensure(["user_log_dir"])[0], "fh.log"))
+                else:
+                    handler = dirs.log_handler()
+                logger = logging.getLogger("bench.%s.%d" % (label, nthreads))
+                logger.propagate = False
+                logger.addHandler(handler)
+
+                def produce():
+                    for i in range(records // nthreads):
+                        logger.warning("record %d", i)
+
+                workers = [threading.Thread(target=produce)
+                           for _ in range(nthreads)]
+                start = time.time()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.time() - start
+                handler.close()
+                logger.removeHandler(handler)
+                results.append(("%s per record (%d threads)" % (label, nthreads),
+                                elapsed / records * 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_app_paths(count=10000):
+    """Memory, allocations and access time for many AppPaths vs. AppDirs."""
+    try:
+        import tracemalloc
+    except ImportError:
+        return []
+    results = []
+    for label in ("AppPaths", "AppDirs+resolve_all"):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        if label == "AppPaths":
+            instances = [appdirs.AppPaths("App%d" % i, "MyCompany")
+                         for i in range(count)]
+        else:
+            instances = [appdirs.AppDirs("App%d" % i, "MyCompany")
+                         for i in range(count)]
+            for dirs in instances:
+                dirs.resolve_all()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        stats = after.compare_to(before, "filename")
+        size = sum(stat.size_diff for stat in stats)
+        blocks = sum(stat.count_diff for stat in stats)
+        results.append(("%s memory per instance (%d)" % (label, count),
+                        float(size) / count, "bytes"))
+        results.append(("%s allocations per instance (%d)" % (label, count),
+                        float(blocks) / count, "blocks"))
+        del instances
+    paths = appdirs.AppPaths("MyApp", "MyCompany")
+    dirs = appdirs.AppDirs("MyApp", "MyCompany")
+    results.append(("AppPaths.user_data_dir access",
+                    bench(lambda: paths.user_data_dir, 100000)))
+    results.append(("AppDirs.user_data_dir access (cached)",
+                    bench(lambda: dirs.user_data_dir, 100000)))
+    results.append(("AppPaths.joinpath",
+                    bench(lambda: paths.joinpath("user_data_dir", "a.db"), 10000)))
+    return results
+
+
+def bench_layout_load():
+    """Startup: load an exported layout vs. resolve every dir, per system."""
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "layout")
+        for system in SYSTEMS:
+            with forced(system, "default"):
+                appdirs.AppDirs("MyApp", "MyCompany", "1.0").export_layout(path)
+
+                def load():
+                    appdirs.AppDirs("MyApp", "MyCompany", "1.0").load_layout(path)
+
+                def resolve():
+                    appdirs.AppDirs("MyApp", "MyCompany", "1.0").resolve_all()
+
+                results.append(("load_layout %s" % system, bench(load, 2000)))
+                results.append(("resolve_all (fresh) %s" % system,
+                                 bench(resolve, 2000)))
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def bench_cli(napps=20):
+    """`python -m appdirs` for many apps: one process vs. one per app."""
+    apps = ["Plugin%d:MyCompany:1.0" % i for i in range(napps)]
+    env = os.environ.copy()
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    def run(argv):
+        subprocess.check_call([sys.executable, "-m", "appdirs"] + argv,
+                              cwd=ROOT, env=env, stdout=subprocess.PIPE)
+
+    def best(func):
+        times = []
+        for _ in range(max(3, int(5 * SCALE))):
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+        return min(times) * 1e6
+
+    def per_app():
+        for app in apps:
+            run(["-k", "user_cache_dir", "-f", "shell", app])
+
+    run(["MyApp"])  # write the bytecode cache
+    return [
+        ("CLI one call (%d apps)" % napps,
+         best(lambda: run(["-k", "user_cache_dir", "-f", "shell"] + apps))),
+        ("CLI one call per app (%d apps)" % napps, best(per_app)),
+    ]
+
+
+def _lock_worker(shared, count):
+    dirs = appdirs.AppDirs("BenchApp")
+    path = os.path.join(dirs.user_state_dir, "counter")
+    for _ in range(count):
+        with dirs.lock("user_state_dir", "counter", shared=shared):
+            with open(path) as f:
+                value = int(f.read())
+            if not shared:
+                with open(path, "w") as f:
+                    f.write(str(value + 1))
+
+
+def bench_lock(processes=(1, 4, 16), count=2000):
+    """AppDirs.lock() throughput with many contending processes.
+
+    Exclusive lockers increment a counter file (checked afterwards);
+    shared lockers only read it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return []
+    import multiprocessing
+
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp()
+    os.environ["XDG_STATE_HOME"] = tmpdir
+    results = []
+    try:
+        dirs = appdirs.AppDirs("BenchApp")
+        path = os.path.join(dirs.ensure(["user_state_dir"])[0], "counter")
+        count = max(10, int(count * SCALE))
+        for nprocs in processes:
+            for shared in (False, True):
+                with open(path, "w") as f:
+                    f.write("0")
+                per_proc = count // nprocs
+                workers = [multiprocessing.Process(target=_lock_worker,
+                                                   args=(shared, per_proc))
+                           for _ in range(nprocs)]
+                start = time.time()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.time() - start
+                with open(path) as f:
+                    total = int(f.read())
+                expected = not shared and per_proc * nprocs or 0
+                if total != expected:
+                    raise AssertionError("lost updates: %d != %d"
+                                         % (total, expected))
+                results.append((
+                    "lock %s per acquisition (%d procs)"
+                    % (shared and "shared" or "exclusive", nprocs),
+                    elapsed / (per_proc * nprocs) * 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_atomic_writes(nfiles=200, batch_sizes=(10, 100)):
+    """Durable small-file writes: fsync per file vs. batched group commit."""
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp(dir=os.path.expanduser("~"))
+    os.environ["XDG_STATE_HOME"] = tmpdir
+    data = b"x" * 512
+    nfiles = max(20, int(nfiles * SCALE))
+    results = []
+    try:
+        dirs = appdirs.AppDirs("BenchApp")
+        statedir = dirs.ensure(["user_state_dir"])[0]
+
+        def naive():
+            # The usual hand-rolled version: fsync the file, rename, fsync dir.
+            for i in range(nfiles):
+                path = os.path.join(statedir, "n%d" % i)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(path + ".tmp", path)
+                fd = os.open(statedir, os.O_RDONLY)
+                os.fsync(fd)
+                os.close(fd)
+
+        def per_file():
+            for i in range(nfiles):
+                dirs.write_atomic("user_state_dir", "f%d" % i, data)
+
+        def batched(size):
+            for start in range(0, nfiles, size):
+                with dirs.atomic_writes("user_state_dir") as batch:
+                    for i in range(start, min(start + size, nfiles)):
+                        batch.write("b%d" % i, data)
+
+        for label, func in [("fsync per file (hand-rolled)", naive),
+                            ("write_atomic per file", per_file)] + [
+                ("atomic_writes batch of %d" % size,
+                 lambda size=size: batched(size)) for size in batch_sizes]:
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            results.append(("durable write, %s" % label,
+                            elapsed / nfiles * 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_cache_store(nkeys=2000):
+    """CacheStore get/put vs. the one-file-per-key pattern."""
+    try:
+        import sqlite3
+    except ImportError:
+        return []
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp(dir=os.path.expanduser("~"))
+    os.environ["XDG_CACHE_HOME"] = tmpdir
+    nkeys = max(100, int(nkeys * SCALE))
+    keys = ["key%d" % i for i in range(nkeys)]
+    value = b"v" * 256
+    results = []
+    try:
+        dirs = appdirs.AppDirs("BenchApp")
+        filedir = os.path.join(dirs.ensure(["user_cache_dir"])[0], "files")
+        os.mkdir(filedir)
+
+        def file_put():
+            for key in keys:
+                with open(os.path.join(filedir, key), "wb") as f:
+                    f.write(value)
+
+        def file_get():
+            for key in keys:
+                with open(os.path.join(filedir, key), "rb") as f:
+                    f.read()
+
+        hot = dirs.cache_store("hot", hot_size=nkeys)
+        cold = dirs.cache_store("cold", hot_size=0)
+
+        def store_put(store):
+            for key in keys:
+                store.set(key, value)
+
+        def store_get(store):
+            for key in keys:
+                store.get(key)
+
+        for label, func in (
+                ("one file per key put", file_put),
+                ("one file per key get", file_get),
+                ("cache_store put", lambda: store_put(hot)),
+                ("cache_store get (hot tier)", lambda: store_get(hot)),
+                ("cache_store get (no hot tier)", lambda: store_get(cold))):
+            if label == "cache_store get (no hot tier)":
+                store_put(cold)
+            results.append((label, bench(func, 1) / nkeys))
+        hot.close()
+        cold.close()
+    finally:
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_blob_store(nfiles=50, size=1024 * 1024, nsmall=20000):
+    """BlobStore ingest of 1MB files per mode, and lookups among many blobs."""
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp(dir=os.path.expanduser("~"))
+    os.environ["XDG_DATA_HOME"] = tmpdir
+    nfiles = max(5, int(nfiles * SCALE))
+    nsmall = max(1000, int(nsmall * SCALE))
+    results = []
+    try:
+        store = appdirs.AppDirs("BenchApp").blob_store()
+        srcdir = os.path.join(tmpdir, "src")
+        os.mkdir(srcdir)
+
+        def make_sources(tag):
+            paths = []
+            for i in range(nfiles):
+                path = os.path.join(srcdir, "%s%d" % (tag, i))
+                with open(path, "wb") as f:
+                    f.write(os.urandom(size))
+                paths.append(path)
+            return paths
+
+        for label in ("streamed copy", "hardlink", "move"):
+            paths = make_sources(label[0])
+            start = time.time()
+            for path in paths:
+                if label == "streamed copy":
+                    with open(path, "rb") as f:
+                        store.put_stream(f)
+                else:
+                    store.put_file(path, move=label == "move")
+            elapsed = time.time() - start
+            results.append(("blob ingest 1MB, %s" % label,
+                            elapsed / nfiles * 1e6))
+
+        digests = [store.put(str(i).encode("ascii")) for i in range(nsmall)]
+        results.append(("blob lookup (%d blobs)" % nsmall,
+                        bench(lambda: digests[-1] in store, 10000)))
+    finally:
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+def bench_users(nusers=2000):
+    """Dirs for many users: mutating os.environ vs. explicit env/home."""
+    users = [("/home/user%d" % i,
+              i % 2 and {"XDG_CONFIG_HOME": "/srv/config/user%d" % i} or None)
+             for i in range(max(100, int(nusers * SCALE)))]
+    saved = os.environ.copy()
+
+    def mutate_environ():
+        for home, env in users:
+            for name in ("HOME", "XDG_CONFIG_HOME"):
+                os.environ.pop(name, None)
+            os.environ["HOME"] = home
+            os.environ.update(env or {})
+            appdirs.AppDirs("MyApp").resolve_all()
+
+    def explicit():
+        for home, env in users:
+            appdirs.AppDirs("MyApp", env=env or {}, home=home).resolve_all()
+
+    def bulk():
+        appdirs.resolve_users(users, "MyApp")
+
+    try:
+        return [("%s per user" % label, bench(func, 1) / len(users))
+                for label, func in (("mutate os.environ", mutate_environ),
+                                    ("AppDirs(env=, home=)", explicit),
+                                    ("resolve_users", bulk))]
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def bench_runtime_churn(nfiles=2000):
+    """Small-file churn (create, write, rename, remove) per dir kind.
+
+    The runtime dir is measured with $XDG_RUNTIME_DIR on /dev/shm (tmpfs,
+    where available) and with the /tmp fallback.
+    """
+    saved = os.environ.copy()
+    tmpdir = tempfile.mkdtemp(dir=os.path.expanduser("~"))
+    nfiles = max(100, int(nfiles * SCALE))
+    data = b"12345\n"
+    variants = [("user_cache_dir", {"XDG_CACHE_HOME": tmpdir})]
+    if os.path.isdir("/dev/shm"):
+        variants.append(("user_runtime_dir (tmpfs)",
+                         {"XDG_RUNTIME_DIR": tempfile.mkdtemp(dir="/dev/shm")}))
+    variants.append(("user_runtime_dir (fallback)",
+                     {"XDG_RUNTIME_DIR": "", "TMPDIR": tmpdir}))
+    results = []
+    try:
+        for label, env in variants:
+            os.environ.update(env)
+            kind = label.split()[0]
+            path = appdirs.AppDirs("BenchApp").ensure([kind])[0]
+
+            def churn():
+                for i in range(nfiles):
+                    name = os.path.join(path, "f%d" % i)
+                    with open(name + ".tmp", "wb") as f:
+                        f.write(data)
+                    os.rename(name + ".tmp", name)
+                    os.remove(name)
+
+            results.append(("small-file churn, %s" % label,
+                            bench(churn, 1) / nfiles))
+    finally:
+        for label, env in variants:
+            runtime = env.get("XDG_RUNTIME_DIR")
+            if runtime:
+                shutil.rmtree(runtime)
+        shutil.rmtree(tmpdir)
+        os.environ.clear()
+        os.environ.update(saved)
+    return results
+
+
+GROUPS = (
+    bench_resolution,
+    bench_import,
+    bench_resolve_many,
+    bench_folder_backend,
+    bench_aio_loop_lag,
+    bench_log_handler,
+    bench_app_paths,
+    bench_layout_load,
+    bench_cli,
+    bench_lock,
+    bench_atomic_writes,
+    bench_cache_store,
+    bench_blob_store,
+    bench_users,
+    bench_runtime_churn,
+)
+
+
+def compare(results, baseline, threshold):
+    """Return (name, old, new) for benchmarks slower than allowed."""
+    regressions = []
+    for name, usec in sorted(results.items()):
+        old = baseline.get(name)
+        if old and usec > old * (1 + threshold):
+            regressions.append((name, old, usec))
+    return regressions
+
+
+def main(argv=None):
+    global SCALE
+    parser = argparse.ArgumentParser(
+        description="Run the appdirs benchmark suite.")
+    parser.add_argument("--only", metavar="SUBSTRING",
+                        help="only run groups whose name contains SUBSTRING")
+    parser.add_argument("--quick", action="store_true",
+                        help="run fewer iterations")
+    parser.add_argument("--json", metavar="OUTPUT",
+                        help="write results as JSON to OUTPUT")
+    parser.add_argument("--baseline", metavar="BASELINE",
+                        help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a "
+                             "fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.quick:
+        SCALE = 0.1
+
+    results = {}
+    for group in GROUPS:
+        if args.only and args.only not in group.__name__:
+            continue
+        for result in group():
+            name, value, unit = (result + ("us",))[:3]
+            results[name] = value
+            print("%-56s %12.2f %s" % (name, value, unit))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "appdirs": appdirs.__version__,
+                "python": platform.python_version(),
+                "platform": sys.platform,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print("REGRESSION: %s: %.2f -> %.2f (+%.0f%%)"
+                  % (name, old, new, (new / old - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
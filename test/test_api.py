@@ -1,14 +1,24 @@
+import json
+import os
+import shutil
 import sys
+import tempfile
+import time
 import appdirs
 
-if sys.version_info < (2, 7):
-    import unittest2 as unittest
-else:
-    import unittest
+try:
+    import asyncio
+    import appdirs_aio
+except (ImportError, SyntaxError):
+    appdirs_aio = None
+
+import unittest
 
 if sys.version_info[0] < 3:
+    from StringIO import StringIO
     STRING_TYPE = basestring
 else:
+    from io import StringIO
     STRING_TYPE = str
 
 
@@ -28,6 +38,8 @@ class Test_AppDir(unittest.TestCase):
             appdirs.user_state_dir('MyApp', 'MyCompany'), STRING_TYPE)
         self.assertIsInstance(
             appdirs.user_log_dir('MyApp', 'MyCompany'), STRING_TYPE)
+        self.assertIsInstance(
+            appdirs.user_runtime_dir('MyApp', 'MyCompany'), STRING_TYPE)
 
     def test_dirs(self):
         dirs = appdirs.AppDirs('MyApp', 'MyCompany', version='1.0')
@@ -36,6 +48,914 @@ class Test_AppDir(unittest.TestCase):
         self.assertIsInstance(dirs.user_cache_dir, STRING_TYPE)
         self.assertIsInstance(dirs.user_state_dir, STRING_TYPE)
         self.assertIsInstance(dirs.user_log_dir, STRING_TYPE)
+        self.assertIsInstance(dirs.user_runtime_dir, STRING_TYPE)
+
+
+class Test_AppDirCache(unittest.TestCase):
+    def setUp(self):
+        self._system = appdirs.system
+        self._environ = os.environ.copy()
+        appdirs.system = 'linux2'
+        os.environ['XDG_DATA_HOME'] = '/xdg/data'
+
+    def tearDown(self):
+        appdirs.system = self._system
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+    def test_hits_and_misses(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+        self.assertEqual(dirs.user_data_dir, '/xdg/data/MyApp')
+        self.assertEqual(dirs.user_data_dir, '/xdg/data/MyApp')
+        self.assertEqual((dirs.cache_hits, dirs.cache_misses), (1, 1))
+
+    def test_env_change_invalidates(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+        self.assertEqual(dirs.user_data_dir, '/xdg/data/MyApp')
+        os.environ['XDG_DATA_HOME'] = '/other/data'
+        self.assertEqual(dirs.user_data_dir, '/other/data/MyApp')
+        self.assertEqual(dirs.cache_misses, 2)
+
+    def test_env_fingerprint(self):
+        before = appdirs._env_fingerprint()
+        os.environ['XDG_CACHE_HOME'] = '/xdg/cache'
+        self.assertNotEqual(appdirs._env_fingerprint(), before)
+        del os.environ['XDG_CACHE_HOME']
+        self.assertEqual(appdirs._env_fingerprint(), before)
+        if sys.version_info[0] >= 3 and os.name == 'posix':
+            self.assertTrue(appdirs._raw_environ is not None)
+        # a replaced os.environ is read through its public API
+        saved = os.environ
+        os.environ = dict(saved, XDG_DATA_HOME='/dict/data')
+        try:
+            self.assertTrue('/dict/data' in appdirs._env_fingerprint())
+            self.assertEqual(appdirs.AppDirs('MyApp').user_data_dir,
+                             '/dict/data/MyApp')
+        finally:
+            os.environ = saved
+
+    def test_immutable(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany', version='1.0')
+        self.assertRaises(AttributeError, setattr, dirs, 'version', '2.0')
+        self.assertEqual(dirs, appdirs.AppDirs('MyApp', 'MyCompany', '1.0'))
+        self.assertNotEqual(dirs, appdirs.AppDirs('MyApp', 'MyCompany'))
+        self.assertEqual(len(set([dirs, appdirs.AppDirs('MyApp', 'MyCompany',
+                                                        '1.0')])), 1)
+
+    def test_shared(self):
+        dirs = appdirs.AppDirs.shared('MyApp', 'MyCompany', version='1.0')
+        self.assertTrue(dirs is appdirs.AppDirs.shared('MyApp', 'MyCompany',
+                                                       '1.0'))
+        self.assertFalse(dirs is appdirs.AppDirs.shared('MyApp'))
+        dirs.user_data_dir
+        self.assertEqual(appdirs.AppDirs.shared(
+            'MyApp', 'MyCompany', '1.0').cache_misses, 1)
+        key = id(dirs)
+        del dirs
+        import gc
+        gc.collect()
+        self.assertFalse(any(id(d) == key
+                             for d in appdirs.AppDirs._shared.values()))
+
+    def test_layout_export(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'layout')
+            appdirs.AppDirs('MyApp', 'MyCompany').export_layout(path)
+            dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+            self.assertTrue(dirs.load_layout(path))
+            self.assertEqual(dirs.user_data_dir, '/xdg/data/MyApp')
+            self.assertEqual(dirs.cache_misses, 0)
+            self.assertFalse(appdirs.AppDirs('Other').load_layout(path))
+            os.environ['XDG_DATA_HOME'] = '/other/data'
+            dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+            self.assertFalse(dirs.load_layout(path))
+            self.assertEqual(dirs.user_data_dir, '/other/data/MyApp')
+            with open(path, 'wb') as f:
+                f.write(b'garbage')
+            self.assertFalse(dirs.load_layout(path))
+            self.assertFalse(dirs.load_layout(path + '.missing'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_clear_cache(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+        dirs.user_data_dir
+        dirs.clear_cache()
+        self.assertEqual((dirs.cache_hits, dirs.cache_misses), (0, 0))
+        dirs.user_data_dir
+        self.assertEqual(dirs.cache_misses, 1)
+
+
+class TempDirsTestCase(unittest.TestCase):
+    """Points every user dir, and the runtime dir, into a temp dir."""
+    def setUp(self):
+        self._system = appdirs.system
+        self._environ = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        appdirs.system = 'linux2'
+        for name in ('DATA', 'CONFIG', 'CACHE', 'STATE'):
+            os.environ['XDG_%s_HOME' % name] = os.path.join(
+                self.tmpdir, 'home', name.lower())
+        os.environ['XDG_RUNTIME_DIR'] = os.path.join(self.tmpdir, 'run')
+
+    def tearDown(self):
+        appdirs.system = self._system
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.tmpdir)
+
+
+class Test_Ensure(TempDirsTestCase):
+    def test_ensure(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany', version='1.0')
+        paths = dirs.ensure()
+        self.assertEqual(len(paths), 6)
+        for path in paths:
+            self.assertTrue(os.path.isdir(path))
+        self.assertTrue(os.path.isdir(dirs.user_log_dir))
+        shutil.rmtree(dirs.user_cache_dir)
+        dirs.ensure(['user_cache_dir'])
+        self.assertFalse(os.path.isdir(dirs.user_cache_dir))
+        dirs.clear_cache()
+        dirs.ensure(['user_cache_dir'])
+        self.assertTrue(os.path.isdir(dirs.user_cache_dir))
+        self.assertRaises(ValueError, dirs.ensure, ['nope'])
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires os.getuid')
+    def test_runtime_dir(self):
+        dirs = appdirs.AppDirs('MyApp', version='1.0')
+        self.assertEqual(dirs.user_runtime_dir,
+                         os.path.join(self.tmpdir, 'run', 'MyApp', '1.0'))
+        del os.environ['XDG_RUNTIME_DIR']
+        os.environ['TMPDIR'] = self.tmpdir
+        base = os.path.join(self.tmpdir, 'runtime-%d' % os.getuid())
+        self.assertEqual(appdirs.user_runtime_dir('MyApp'),
+                         os.path.join(base, 'MyApp'))
+        os.mkdir(base, 0o755)
+        dirs.ensure(['user_runtime_dir'])
+        self.assertTrue(os.path.isdir(dirs.user_runtime_dir))
+        self.assertEqual(os.stat(base).st_mode & 0o777, 0o700)
+        shutil.rmtree(base)
+        os.symlink(self.tmpdir, base)
+        self.assertRaises(OSError, appdirs.AppDirs('MyApp').ensure,
+                          ['user_runtime_dir'])
+
+    def test_ensure_existing(self):
+        dirs = appdirs.AppDirs('MyApp')
+        os.makedirs(dirs.user_data_dir)
+        other = appdirs.AppDirs('MyApp')
+        self.assertEqual(other.ensure(['user_data_dir']), [dirs.user_data_dir])
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires fcntl')
+    def test_user_dir_removed(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.write_atomic('user_runtime_dir', 'pid', b'1')
+        dirs.write_atomic('user_state_dir', 'state', b'1')
+        shutil.rmtree(os.path.join(self.tmpdir, 'run'))
+        shutil.rmtree(dirs.user_state_dir)
+        with dirs.lock('user_runtime_dir', 'app') as lock:
+            self.assertTrue(os.path.exists(lock.path))
+        dirs.write_atomic('user_state_dir', 'state', b'2')
+        with open(os.path.join(dirs.user_state_dir, 'state')) as f:
+            self.assertEqual(f.read(), '2')
+        with dirs.atomic_writes('user_runtime_dir') as batch:
+            batch.write('pid', b'2')
+        self.assertEqual(sorted(os.listdir(dirs.user_runtime_dir)),
+                         ['app.lock', 'pid'])
+
+
+class Test_FindFile(TempDirsTestCase):
+    def test_find_file(self):
+        site = [os.path.join(self.tmpdir, 'site%d' % i) for i in (1, 2)]
+        os.environ['XDG_DATA_DIRS'] = os.pathsep.join(site)
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.find_recheck_interval = 0
+        os.makedirs(os.path.join(dirs.user_data_dir, 'sub'))
+        for path in site:
+            os.makedirs(os.path.join(path, 'MyApp', 'sub'))
+        site2 = os.path.join(site[1], 'MyApp', 'sub', 'a.txt')
+        open(site2, 'w').close()
+        self.assertEqual(dirs.find_data_file('sub/a.txt'), site2)
+        self.assertEqual(dirs.find_data_file('b.txt'), None)
+        user = os.path.join(dirs.user_data_dir, 'sub', 'a.txt')
+        open(user, 'w').close()
+        self.assertEqual(dirs.find_data_file('sub/a.txt'), user)
+        self.assertEqual(dirs.find_config_file('sub/a.txt'), None)
+
+    def test_find_file_cached(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.find_recheck_interval = 3600
+        self.assertEqual(dirs.find_data_file('a.txt'), None)
+        dirs.ensure(['user_data_dir'])
+        open(os.path.join(dirs.user_data_dir, 'a.txt'), 'w').close()
+        self.assertEqual(dirs.find_data_file('a.txt'), None)
+        dirs.clear_cache()
+        self.assertEqual(dirs.find_data_file('a.txt'),
+                         os.path.join(dirs.user_data_dir, 'a.txt'))
+
+
+class Test_ConfigIndex(TempDirsTestCase):
+    def test_config_index(self):
+        site = os.path.join(self.tmpdir, 'site')
+        os.environ['XDG_CONFIG_DIRS'] = site
+        dirs = appdirs.AppDirs('MyApp')
+        user = dirs.user_config_dir
+        for path in (user, os.path.join(site, 'MyApp', 'plugins')):
+            os.makedirs(path)
+        for name in ('a.ini', os.path.join('plugins', 'b.ini')):
+            open(os.path.join(site, 'MyApp', name), 'w').close()
+        index = appdirs.ConfigIndex(dirs)
+        self.assertEqual(sorted(index), ['a.ini', os.path.join('plugins', 'b.ini')])
+        self.assertEqual(index['a.ini'], (os.path.join(site, 'MyApp', 'a.ini'), ()))
+        open(os.path.join(user, 'a.ini'), 'w').close()
+        index.refresh()
+        self.assertEqual(index['a.ini'], (os.path.join(user, 'a.ini'),
+                                          (os.path.join(site, 'MyApp', 'a.ini'),)))
+        self.assertTrue('plugins/b.ini' in index)
+        self.assertEqual(index.get('c.ini'), None)
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), 'requires os.symlink')
+    def test_config_index_symlinks(self):
+        site = os.path.join(self.tmpdir, 'site')
+        real = os.path.join(self.tmpdir, 'real')
+        os.environ['XDG_CONFIG_DIRS'] = site
+        os.makedirs(os.path.join(site, 'MyApp'))
+        os.makedirs(real)
+        open(os.path.join(real, 'x.ini'), 'w').close()
+        os.symlink(real, os.path.join(site, 'MyApp', 'conf.d'))
+        os.symlink(real, os.path.join(real, 'loop'))
+        dirs = appdirs.AppDirs('MyApp')
+        index = appdirs.ConfigIndex(dirs)
+        self.assertEqual(sorted(index), [os.path.join('conf.d', 'x.ini')])
+        self.assertEqual(index['conf.d/x.ini'][0],
+                         dirs.find_config_file('conf.d/x.ini'))
+
+
+class Test_CacheManager(TempDirsTestCase):
+    def test_cache_manager(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.ensure(['user_cache_dir', 'user_log_dir'])
+        cache = dirs.user_cache_dir
+        os.makedirs(os.path.join(cache, 'sub'))
+        with open(os.path.join(dirs.user_log_dir, 'app.log'), 'w') as f:
+            f.write('x' * 100)
+        for i, name in enumerate(['a', 'b', os.path.join('sub', 'c')]):
+            path = os.path.join(cache, name)
+            with open(path, 'w') as f:
+                f.write('x' * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+        manager = dirs.cache_manager(max_bytes=25)
+        self.assertEqual(manager.usage(), (30, 3))
+        manager.touch('a')
+        self.assertEqual(manager.enforce(), ['b'])
+        self.assertEqual(sorted(os.listdir(cache)),
+                         ['.appdirs-cache-index', 'a', 'log', 'sub'])
+
+        manager = dirs.cache_manager(max_files=1)
+        self.assertEqual(manager.enforce(), [os.path.join('sub', 'c')])
+        self.assertTrue(os.path.exists(os.path.join(dirs.user_log_dir, 'app.log')))
+
+    def test_cache_manager_new_files(self):
+        dirs = appdirs.AppDirs('MyApp')
+        cache = dirs.ensure(['user_cache_dir'])[0]
+        manager = dirs.cache_manager(max_bytes=1000)
+        self.assertEqual(manager.usage(), (0, 0))
+        os.makedirs(os.path.join(cache, 'sub'))
+        for i in range(50):
+            name = os.path.join('sub' if i % 2 else '', 'f%02d' % i)
+            path = os.path.join(cache, name)
+            with open(path, 'w') as f:
+                f.write('x' * 1000)
+            os.utime(path, (1000 + i, 1000 + i))
+        self.assertEqual(manager.usage(), (50000, 50))
+        self.assertEqual(len(manager.enforce()), 49)
+        self.assertEqual(manager.usage(), (1000, 1))
+        self.assertTrue(os.path.exists(os.path.join(cache, 'sub', 'f49')))
+
+        # a fresh manager must not trust the persisted index either
+        with open(os.path.join(cache, 'late'), 'w') as f:
+            f.write('x' * 1000)
+        manager = dirs.cache_manager(max_bytes=1000)
+        self.assertEqual(manager.usage(), (2000, 2))
+        self.assertEqual(manager.enforce(), [os.path.join('sub', 'f49')])
+
+    def test_cache_manager_replaced_files(self):
+        dirs = appdirs.AppDirs('MyApp')
+        cache = dirs.ensure(['user_cache_dir'])[0]
+        for name in ('a.bin', 'b.bin'):
+            with open(os.path.join(cache, name), 'wb') as f:
+                f.write(b'x')
+        manager = dirs.cache_manager(max_bytes=1000)
+        self.assertEqual(manager.usage(), (2, 2))
+        manager.enforce()
+        dirs.write_atomic('user_cache_dir', 'a.bin', b'x' * 100000)
+        self.assertEqual(dirs.cache_manager(max_bytes=1000).usage(),
+                         (100001, 2))
+        with open(os.path.join(cache, 'b.bin'), 'ab') as f:
+            f.write(b'x' * 99)
+        self.assertEqual(manager.usage(), (100100, 2))
+        self.assertEqual(manager.enforce(), ['a.bin'])
+
+    def test_cache_manager_background(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.ensure(['user_cache_dir'])
+        open(os.path.join(dirs.user_cache_dir, 'a'), 'w').close()
+        manager = dirs.cache_manager(max_files=0)
+        manager.start(0.01)
+        try:
+            for _ in range(500):
+                if not os.path.exists(os.path.join(dirs.user_cache_dir, 'a')):
+                    break
+                time.sleep(0.01)
+        finally:
+            manager.stop()
+        self.assertEqual(manager.usage(), (0, 0))
+
+
+class Test_LogRetention(TempDirsTestCase):
+    def test_log_retention(self):
+        dirs = appdirs.AppDirs('MyApp')
+        logdir = dirs.ensure(['user_log_dir'])[0]
+        now = time.time()
+        for name, age in (('app.log', 0), ('app.log.1', 10),
+                          ('app.log.2', 1000), ('app.log.3.gz', 20)):
+            path = os.path.join(logdir, name)
+            with open(path, 'w') as f:
+                f.write('x' * 1000)
+            os.utime(path, (now - age, now - age))
+        with open(os.path.join(logdir, 'app.log.lock'), 'w'):
+            pass
+        retention = dirs.log_retention(max_age=500)
+        compressed, deleted = retention.run_once()
+        self.assertEqual(compressed, ['app.log.1'])
+        self.assertEqual(deleted, ['app.log.2'])
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now - 10))
+        self.assertEqual(sorted(os.listdir(logdir)),
+                         ['app.log', 'app.log.1.%s.gz' % stamp, 'app.log.3.gz',
+                          'app.log.lock'])
+
+        retention = dirs.log_retention(max_bytes=1500, compress=False)
+        self.assertEqual(retention.run_once(), ([], ['app.log.3.gz']))
+        self.assertEqual(retention.run_once(), ([], []))
+        self.assertTrue(os.path.exists(os.path.join(logdir, 'app.log')))
+
+    def test_log_retention_rollover(self):
+        import gzip
+        import logging.handlers
+        dirs = appdirs.AppDirs('MyApp')
+        logdir = dirs.ensure(['user_log_dir'])[0]
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(logdir, 'app.log'), maxBytes=1000, backupCount=3)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        retention = dirs.log_retention()
+        records = []
+        try:
+            for generation in range(4):
+                record = 'generation %d ' % generation + 'x' * 100
+                records.append(record)
+                handler.emit(logging.makeLogRecord({'msg': record}))
+                handler.doRollover()
+                retention.run_once()
+        finally:
+            handler.close()
+        contents = []
+        for name in sorted(os.listdir(logdir)):
+            if name.endswith('.gz'):
+                with gzip.open(os.path.join(logdir, name)) as f:
+                    contents.append(f.read().decode('ascii').strip())
+        self.assertEqual(sorted(contents), records)
+
+    def test_log_retention_rollover_uncompressed(self):
+        import logging.handlers
+        dirs = appdirs.AppDirs('MyApp')
+        logdir = dirs.ensure(['user_log_dir'])[0]
+        path = os.path.join(logdir, 'app.log')
+        with open(path + '.1', 'w') as f:
+            f.write('old\n')
+        old = time.time() - 47 * 3600
+        os.utime(path + '.1', (old, old))
+        handler = logging.handlers.RotatingFileHandler(path, backupCount=3)
+        retention = dirs.log_retention(max_age=48 * 3600, compress=False)
+        try:
+            handler.emit(logging.makeLogRecord({'msg': 'new'}))
+            self.assertEqual(retention.run_once(), ([], []))
+            handler.doRollover()
+        finally:
+            handler.close()
+        # two hours later, only the old generation is too old
+        retention.max_age = 46 * 3600
+        self.assertEqual(retention.run_once(), ([], ['app.log.2']))
+        with open(path + '.1') as f:
+            self.assertEqual(f.read(), 'new\n')
+
+
+class Test_LogHandler(TempDirsTestCase):
+    def test_log_handler(self):
+        import logging
+        dirs = appdirs.AppDirs('MyApp')
+        handler = dirs.log_handler()
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        logger = logging.getLogger('appdirs-test')
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for i in range(1000):
+                logger.warning('record %d', i)
+            handler.flush()
+            path = os.path.join(dirs.user_log_dir, 'MyApp.log')
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 1000)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        with open(path) as f:
+            self.assertEqual(f.readline(), 'WARNING record 0\n')
+
+    def test_log_handler_errors(self):
+        import logging
+        dirs = appdirs.AppDirs('MyApp')
+        path = os.path.join(dirs.ensure(['user_log_dir'])[0], 'MyApp.log')
+        os.mkdir(path)
+        handler = dirs.log_handler(max_queue=10)
+        errors = []
+        handler.handleError = errors.append
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        try:
+            handler.handle(logging.makeLogRecord({'msg': 'lost'}))
+            handler.flush()
+            self.assertEqual([r.msg for r in errors], ['lost'])
+
+            # the writer survives and opens the file again once it can
+            os.rmdir(path)
+            for i in range(100):
+                handler.handle(logging.makeLogRecord({'msg': 'record %d' % i}))
+        finally:
+            handler.close()
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 100)
+        self.assertEqual(len(errors), 1)
+
+
+class Test_Lock(TempDirsTestCase):
+    @unittest.skipIf(sys.platform == 'win32', 'requires fcntl')
+    def test_lock(self):
+        dirs = appdirs.AppDirs('MyApp')
+        with dirs.lock('user_state_dir', 'db') as lock:
+            self.assertTrue(lock.locked)
+            self.assertEqual(lock.path,
+                             os.path.join(dirs.user_state_dir, 'db.lock'))
+            other = dirs.lock('user_state_dir', 'db', timeout=0.05)
+            self.assertRaises(appdirs.LockTimeout, other.acquire)
+            self.assertFalse(other.locked)
+        self.assertFalse(lock.locked)
+        with dirs.lock('user_state_dir', 'db', shared=True):
+            with dirs.lock('user_state_dir', 'db', shared=True, timeout=0):
+                self.assertRaises(appdirs.LockTimeout,
+                                  dirs.lock('user_state_dir', 'db',
+                                            timeout=0).acquire)
+        with dirs.lock('user_state_dir', 'db', timeout=0):
+            pass
+        self.assertRaises(ValueError, dirs.lock, 'site_data_dir', 'db')
+        self.assertRaises(ValueError, dirs.lock, 'user_state_dir', '../db')
+
+
+class Test_AtomicWrites(TempDirsTestCase):
+    def test_atomic_writes(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.write_atomic('user_state_dir', 'state.json', u'{"a": 1}')
+        path = os.path.join(dirs.user_state_dir, 'state.json')
+        with open(path) as f:
+            self.assertEqual(f.read(), '{"a": 1}')
+        with dirs.atomic_writes('user_config_dir') as batch:
+            batch.write('a', b'1')
+            batch.write('b', b'2')
+            batch.write('a', b'3')
+            self.assertFalse(os.path.exists(
+                os.path.join(dirs.user_config_dir, 'a')))
+        self.assertEqual(sorted(os.listdir(dirs.user_config_dir)), ['a', 'b'])
+        with open(os.path.join(dirs.user_config_dir, 'a')) as f:
+            self.assertEqual(f.read(), '3')
+        try:
+            with dirs.atomic_writes('user_config_dir') as batch:
+                batch.write('a', b'4')
+                raise KeyError
+        except KeyError:
+            pass
+        self.assertEqual(sorted(os.listdir(dirs.user_config_dir)), ['a', 'b'])
+        with open(os.path.join(dirs.user_config_dir, 'a')) as f:
+            self.assertEqual(f.read(), '3')
+        self.assertRaises(ValueError, dirs.write_atomic, 'user_state_dir',
+                          'sub/x', b'')
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires POSIX permissions')
+    def test_atomic_writes_keep_mode(self):
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.write_atomic('user_config_dir', 'secrets.ini', b'a')
+        path = os.path.join(dirs.user_config_dir, 'secrets.ini')
+        os.chmod(path, 0o600)
+        dirs.write_atomic('user_config_dir', 'secrets.ini', b'b')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        os.chmod(path, 0o640)
+        with dirs.atomic_writes('user_config_dir', durable=False) as batch:
+            batch.write('secrets.ini', b'c')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'c')
+
+
+class Test_CacheStore(TempDirsTestCase):
+    def test_cache_store(self):
+        dirs = appdirs.AppDirs('MyApp')
+        store = dirs.cache_store('things')
+        other = dirs.cache_store('things', hot_size=0)
+        try:
+            self.assertEqual(store.get('a'), None)
+            store.set('a', b'1')
+            self.assertEqual(store.get('a'), b'1')
+            self.assertEqual(other.get('a'), b'1')
+            other.set('a', b'2')
+            self.assertEqual(store.get('a'), b'2')
+            store.set('b', b'3', ttl=-1)
+            self.assertFalse('b' in store)
+            self.assertEqual(other.get('b', b'x'), b'x')
+            self.assertEqual(store.purge(), 1)
+            self.assertTrue(store.delete('a'))
+            self.assertFalse(store.delete('a'))
+            self.assertEqual(other.get('a'), None)
+        finally:
+            store.close()
+            other.close()
+        self.assertTrue(os.path.exists(os.path.join(
+            dirs.user_cache_dir, '.appdirs-stores', 'things.sqlite')))
+        with dirs.cache_store('things') as store:
+            self.assertEqual(store.get('a'), None)
+
+    def test_cache_store_expiry(self):
+        dirs = appdirs.AppDirs('MyApp')
+
+        def count(store):
+            return store._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+        with dirs.cache_store('things') as store:
+            store.PURGE_EVERY = 10
+            for i in range(25):
+                store.set('k%d' % i, b'x', ttl=-1)
+            self.assertEqual(count(store), 5)
+            store.set('live', b'x', ttl=60)
+            store.set('old', b'x', ttl=-1)
+        with dirs.cache_store('things') as store:
+            self.assertEqual(count(store), 1)
+            self.assertEqual(store.get('live'), b'x')
+
+
+class Test_BlobStore(TempDirsTestCase):
+    def test_blob_store(self):
+        import hashlib
+        dirs = appdirs.AppDirs('MyApp')
+        store = dirs.blob_store()
+        digest = store.put(b'data')
+        self.assertEqual(digest, hashlib.sha256(b'data').hexdigest())
+        self.assertEqual(store.path(digest), os.path.join(
+            dirs.user_data_dir, 'blobs', digest[:2], digest[2:4], digest))
+        self.assertEqual(store.put(b'data'), digest)
+        with store.open(digest) as f:
+            self.assertEqual(f.read(), b'data')
+        from io import BytesIO
+        streamed = store.put_stream(BytesIO(b'x' * 1000), chunk_size=64)
+        self.assertEqual(streamed, hashlib.sha256(b'x' * 1000).hexdigest())
+        self.assertEqual(sorted(store), sorted([digest, streamed]))
+
+        src = os.path.join(self.tmpdir, 'src')
+        with open(src, 'wb') as f:
+            f.write(b'file')
+        linked = store.put_file(src)
+        self.assertTrue(os.path.exists(src))
+        if hasattr(os, 'link'):
+            self.assertEqual(os.stat(src).st_ino,
+                             os.stat(store.path(linked)).st_ino)
+        with open(src + '2', 'wb') as f:
+            f.write(b'file')
+        self.assertEqual(store.put_file(src + '2', move=True), linked)
+        self.assertFalse(os.path.exists(src + '2'))
+        self.assertEqual(os.listdir(os.path.join(store.root, 'tmp')), [])
+
+        self.assertTrue(store.delete(digest))
+        self.assertFalse(store.delete(digest))
+        self.assertFalse(digest in store)
+        self.assertRaises(ValueError, store.path, '../' + digest[3:])
+        cache_store = dirs.blob_store('user_cache_dir')
+        self.assertTrue(cache_store.root.startswith(dirs.user_cache_dir))
+
+
+class Test_Usage(TempDirsTestCase):
+    def test_usage(self):
+        site = [os.path.join(self.tmpdir, 'site%d' % i) for i in (1, 2)]
+        os.environ['XDG_DATA_DIRS'] = os.pathsep.join(site)
+        dirs = appdirs.AppDirs('MyApp')
+        dirs.ensure(['user_data_dir', 'user_log_dir'])
+        for base in (dirs.user_data_dir, dirs.user_log_dir,
+                     os.path.join(site[1], 'MyApp', 'sub')):
+            if not os.path.isdir(base):
+                os.makedirs(base)
+            with open(os.path.join(base, 'f'), 'w') as f:
+                f.write('x' * 10)
+        usage = dirs.usage()
+        self.assertEqual(usage['user_data_dir'], (10, 1))
+        self.assertEqual(usage['user_cache_dir'], (10, 1))
+        self.assertEqual(usage['user_log_dir'], (10, 1))
+        self.assertEqual(usage['site_data_dir'], (10, 1))
+        self.assertEqual(usage['user_config_dir'], (0, 0))
+        with open(os.path.join(dirs.user_data_dir, 'g'), 'w') as f:
+            f.write('x' * 5)
+        self.assertEqual(dirs.usage(['user_data_dir']),
+                         {'user_data_dir': (15, 2)})
+        with open(os.path.join(dirs.user_data_dir, 'f'), 'a') as f:
+            f.write('x' * 20)
+        self.assertEqual(dirs.usage(['user_data_dir']),
+                         {'user_data_dir': (35, 2)})
+
+
+class Test_Aio(TempDirsTestCase):
+    @unittest.skipIf(appdirs_aio is None, "asyncio not available")
+    def test_aio(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+        loop = asyncio.new_event_loop()
+        try:
+            run = loop.run_until_complete
+            self.assertEqual(run(appdirs_aio.resolve(dirs, 'user_data_dir')),
+                             dirs.user_data_dir)
+            self.assertFalse(run(appdirs_aio.exists(dirs, 'user_data_dir')))
+            run(appdirs_aio.ensure(dirs, ['user_data_dir']))
+            self.assertTrue(run(appdirs_aio.exists(dirs, 'user_data_dir')))
+            open(os.path.join(dirs.user_data_dir, 'b'), 'w').close()
+            open(os.path.join(dirs.user_data_dir, 'a'), 'w').close()
+            self.assertEqual(run(appdirs_aio.listdir(dirs, 'user_data_dir')),
+                             ['a', 'b'])
+        finally:
+            loop.close()
+
+
+def _fake_win_folder(csidl_name):
+    return {
+        "CSIDL_APPDATA": "C:/Users/me/AppData/Roaming",
+        "CSIDL_COMMON_APPDATA": "C:/ProgramData",
+        "CSIDL_LOCAL_APPDATA": "C:/Users/me/AppData/Local",
+    }[csidl_name]
+
+
+class Test_ResolveAll(unittest.TestCase):
+    def setUp(self):
+        self._system = appdirs.system
+        self._environ = os.environ.copy()
+        appdirs.set_folder_backend(_fake_win_folder)
+
+    def tearDown(self):
+        appdirs.system = self._system
+        os.environ.clear()
+        os.environ.update(self._environ)
+        appdirs.set_folder_backend(None)
+
+    def test_matches_properties(self):
+        os.environ['XDG_DATA_DIRS'] = os.pathsep.join(['/a/', '/b', '~/c'])
+        os.environ['XDG_CACHE_HOME'] = '/cache/'
+        os.environ['XDG_STATE_HOME'] = ''
+        os.environ.pop('XDG_CONFIG_HOME', None)
+        for system in ('linux2', 'darwin', 'win32'):
+            appdirs.system = system
+            for appname in (None, 'MyApp'):
+                for appauthor in (None, False, 'MyCompany'):
+                    for version in (None, '1.0'):
+                        for flag in (False, True):
+                            dirs = appdirs.AppDirs(appname, appauthor, version,
+                                                   roaming=flag, multipath=flag)
+                            layout = dirs.resolve_all()
+                            for kind in appdirs._KINDS:
+                                fresh = appdirs.AppDirs(appname, appauthor,
+                                                        version, flag, flag)
+                                self.assertEqual(getattr(layout, kind),
+                                                 getattr(fresh, kind),
+                                                 (system, kind, appname,
+                                                  appauthor, version, flag))
+
+    def test_populates_cache(self):
+        dirs = appdirs.AppDirs('MyApp', 'MyCompany')
+        layout = dirs.resolve_all()
+        self.assertEqual(dirs.user_cache_dir, layout.user_cache_dir)
+        self.assertEqual(dirs.resolve_all(), layout)
+        self.assertEqual((dirs.cache_hits, dirs.cache_misses), (2, 1))
+        self.assertEqual(dirs.as_dict()['user_log_dir'], layout.user_log_dir)
+
+    @unittest.skipIf(sys.version_info < (3, 4), "pathlib not available")
+    def test_app_paths(self):
+        os.environ['XDG_CONFIG_DIRS'] = os.pathsep.join(['/a', '/b'])
+        for system in ('linux2', 'darwin', 'win32'):
+            appdirs.system = system
+            paths = appdirs.AppPaths('MyApp', 'MyCompany', '1.0')
+            dirs = appdirs.AppDirs('MyApp', 'MyCompany', '1.0')
+            for kind in appdirs._KINDS:
+                self.assertEqual(str(getattr(paths, kind)), getattr(dirs, kind))
+        self.assertEqual([str(p) for p in paths.site_config_dirs],
+                         [dirs.site_config_dir])
+        appdirs.system = 'linux2'
+        paths = appdirs.AppPaths('MyApp')
+        self.assertEqual([str(p) for p in paths.site_config_dirs],
+                         ['/a/MyApp', '/b/MyApp'])
+        self.assertEqual(paths.joinpath('user_data_dir', 'a', 'b'),
+                         paths.user_data_dir / 'a' / 'b')
+        self.assertRaises(AttributeError, setattr, paths, 'version', '2')
+        self.assertRaises(AttributeError, setattr, paths, 'other', 1)
+        self.assertFalse(hasattr(paths, '__dict__'))
+
+    def test_resolve_many(self):
+        apps = [('MyApp', 'MyCompany'), appdirs.AppDirs('Other', version='2')]
+        results = appdirs.resolve_many(apps)
+        self.assertEqual(results[0], appdirs.AppDirs(*apps[0]).resolve_all())
+        self.assertEqual(results[1], apps[1].resolve_all())
+        results = appdirs.resolve_many(apps, kinds=('site_data_dir',
+                                                    'user_data_dir'))
+        self.assertEqual(results[1], (apps[1].site_data_dir,
+                                      apps[1].user_data_dir))
+        self.assertRaises(ValueError, appdirs.resolve_many, apps, ['nope'])
+
+
+    def test_explicit_env(self):
+        os.environ['XDG_DATA_HOME'] = '/process/data'
+        env = {'XDG_CONFIG_HOME': '/u/config',
+               'XDG_DATA_DIRS': os.pathsep.join(['~/share', '/usr/share'])}
+        appdirs.system = 'linux2'
+        self.assertEqual(appdirs.user_data_dir('MyApp', env=env, home='/home/u'),
+                         '/home/u/.local/share/MyApp')
+        self.assertEqual(appdirs.user_config_dir('MyApp', env=env),
+                         '/u/config/MyApp')
+        self.assertEqual(
+            appdirs.site_data_dir('MyApp', multipath=True, env=env,
+                                  home='/home/u'),
+            os.pathsep.join(['/home/u/share/MyApp', '/usr/share/MyApp']))
+        self.assertEqual(appdirs.user_log_dir('MyApp', env={'HOME': '/home/v'}),
+                         '/home/v/.cache/MyApp/log')
+        for system in ('linux2', 'darwin'):
+            appdirs.system = system
+            dirs = appdirs.AppDirs('MyApp', multipath=True, env=env,
+                                   home='/home/u')
+            layout = dirs.resolve_all()
+            for kind in appdirs._KINDS:
+                self.assertEqual(getattr(layout, kind),
+                                 getattr(appdirs.AppDirs('MyApp', multipath=True,
+                                                         env=env, home='/home/u'),
+                                         kind), (system, kind))
+            self.assertEqual(appdirs.resolve_many([dirs]), [layout])
+            self.assertEqual(
+                appdirs.resolve_users([('/home/u', env), '/home/v'], 'MyApp',
+                                      multipath=True),
+                [layout, appdirs.AppDirs('MyApp', multipath=True, env={},
+                                         home='/home/v').resolve_all()])
+        self.assertEqual(appdirs.AppDirs('MyApp', env=env),
+                         appdirs.AppDirs('MyApp', env=dict(env, OTHER='x')))
+        self.assertNotEqual(appdirs.AppDirs('MyApp', env=env),
+                            appdirs.AppDirs('MyApp'))
+        self.assertNotEqual(appdirs.AppDirs('MyApp', env={}),
+                            appdirs.AppDirs('MyApp'))
+        self.assertEqual(appdirs.AppDirs('MyApp', env=env).env, env)
+
+
+class Test_Main(unittest.TestCase):
+    def setUp(self):
+        self.saved_environ = os.environ.copy()
+        os.environ['XDG_DATA_HOME'] = '/xdg/data'
+        os.environ['XDG_CACHE_HOME'] = '/xdg/cache'
+        self.saved_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+        os.environ.clear()
+        os.environ.update(self.saved_environ)
+
+    def main(self, *argv):
+        self.assertEqual(appdirs.main(list(argv)), 0)
+        return sys.stdout.getvalue()
+
+    def test_text(self):
+        self.assertEqual(
+            self.main('MyApp', 'Other:Acme:1.0', '-k', 'user_data_dir',
+                      '-k', 'user_cache_dir'),
+            '/xdg/data/MyApp\n/xdg/cache/MyApp\n'
+            '/xdg/data/Other/1.0\n/xdg/cache/Other/1.0\n')
+
+    def test_formats(self):
+        self.assertEqual(
+            self.main('-f', 'shell', '-k', 'user_data_dir', "it's"),
+            "export IT_S_USER_DATA_DIR='/xdg/data/it'\\''s'\n")
+        sys.stdout = StringIO()
+        self.assertEqual(self.main('-f', 'nul', '-k', 'user_data_dir', 'A', 'B'),
+                         '/xdg/data/A\0/xdg/data/B\0')
+        sys.stdout = StringIO()
+        result = json.loads(self.main('-f', 'json', 'A::2'))
+        self.assertEqual(sorted(result['A::2']), sorted(appdirs._KINDS))
+        self.assertEqual(result['A::2']['user_data_dir'], '/xdg/data/A/2')
+
+    def test_shell_names(self):
+        self.assertEqual(appdirs._shell_name(u'caf\xe9-2', 'user_data_dir'),
+                         'CAF__2_USER_DATA_DIR')
+        self.assertEqual(appdirs._shell_name('2app', 'user_data_dir'),
+                         '_2APP_USER_DATA_DIR')
+        saved_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(SystemExit, appdirs.main,
+                              ['-f', 'shell', 'my-app', 'my_app'])
+            self.assertTrue('MY_APP_' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = saved_stderr
+        self.assertEqual(sys.stdout.getvalue(), '')
+        self.assertEqual(
+            self.main('-f', 'shell', '-k', 'user_data_dir', 'A', 'A'),
+            "export A_USER_DATA_DIR='/xdg/data/A'\n" * 2)
+
+
+class Test_Instrumentation(unittest.TestCase):
+    def tearDown(self):
+        appdirs.disable_instrumentation()
+        appdirs.set_folder_backend(None)
+
+    def test_disabled(self):
+        self.assertEqual(appdirs.instrumentation_stats(), None)
+        user_data_dir = appdirs.user_data_dir
+        appdirs.enable_instrumentation()
+        self.assertNotEqual(appdirs.user_data_dir, user_data_dir)
+        appdirs.disable_instrumentation()
+        self.assertEqual(appdirs.user_data_dir, user_data_dir)
+
+    def test_stats_and_callback(self):
+        events = []
+        appdirs.enable_instrumentation(
+            lambda event, name, value: events.append((event, name)))
+        appdirs.user_data_dir('MyApp')
+        appdirs.user_log_dir('MyApp')
+        appdirs.AppDirs('MyApp').resolve_all()
+        appdirs.set_folder_backend(_fake_win_folder)
+        stats = appdirs.instrumentation_stats()
+        self.assertEqual(stats['calls']['user_data_dir'], 1)
+        self.assertEqual(stats['calls']['_platform_roots'], 1)
+        self.assertTrue(stats['seconds']['user_log_dir'] > 0)
+        self.assertEqual(stats['backends'], [('_fake_win_folder', 'explicit')])
+        if appdirs.system not in ('win32', 'darwin'):
+            self.assertEqual(stats['env_reads']['XDG_DATA_HOME'], 2)
+            self.assertTrue(('env', 'XDG_CACHE_HOME') in events)
+        self.assertTrue(('call', 'user_log_dir') in events)
+
+
+class Test_FolderBackend(unittest.TestCase):
+    def setUp(self):
+        self._backends = list(appdirs._folder_backends)
+
+    def tearDown(self):
+        appdirs._folder_backends[:] = self._backends
+        appdirs.set_folder_backend(None)
+
+    def test_lazy_probe(self):
+        probed = []
+
+        def unavailable():
+            probed.append('unavailable')
+            raise ImportError
+
+        appdirs.register_folder_backend('fake', _fake_win_folder)
+        appdirs.register_folder_backend('unavailable', None, unavailable)
+        self.assertEqual(probed, [])
+        self.assertEqual(appdirs._get_win_folder('CSIDL_COMMON_APPDATA'),
+                         'C:/ProgramData')
+        self.assertEqual(appdirs.get_folder_backend(), 'fake')
+        self.assertEqual(probed, ['unavailable'])
+
+    def test_set_folder_backend(self):
+        appdirs.set_folder_backend(_fake_win_folder)
+        self.assertEqual(appdirs.get_folder_backend(), '_fake_win_folder')
+        appdirs.set_folder_backend('registry')
+        self.assertEqual(appdirs.get_folder_backend(), 'registry')
+        self.assertRaises(ValueError, appdirs.set_folder_backend, 'nope')
+
+    def test_folder_cache(self):
+        calls = []
+
+        def counting(csidl_name):
+            calls.append(csidl_name)
+            return _fake_win_folder(csidl_name)
+
+        appdirs.set_folder_backend(counting)
+        for _ in range(3):
+            appdirs._get_win_folder('CSIDL_APPDATA')
+        self.assertEqual(calls, ['CSIDL_APPDATA'])
+        appdirs.refresh_folder_cache()
+        appdirs._get_win_folder('CSIDL_APPDATA')
+        self.assertEqual(len(calls), 2)
+        appdirs.set_folder_backend(lambda csidl_name: csidl_name)
+        for i in range(appdirs._WIN_FOLDER_CACHE_SIZE * 2):
+            appdirs._get_win_folder('CSIDL_FAKE_%d' % i)
+        self.assertTrue(len(appdirs._win_folder_cache) <=
+                        appdirs._WIN_FOLDER_CACHE_SIZE)
+
 
 if __name__ == "__main__":
     unittest.main()